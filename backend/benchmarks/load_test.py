@@ -0,0 +1,94 @@
+"""HTTP load test measuring throughput of a single API worker.
+
+Start the API with exactly one worker, e.g.
+
+    uvicorn backend.src.main:app --workers 1 --port 8000
+
+and drive it with concurrent clients:
+
+    python -m backend.benchmarks.load_test --url http://127.0.0.1:8000 --concurrency 32 --duration 30
+
+Book reads are mixed with logins (which run bcrypt), so the report shows how
+slow requests on the same worker affect the fast ones. Run it against two
+revisions of the app to compare throughput per worker before and after a change.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+
+
+async def ensure_user(client, username, password):
+    # 200 on first run; later runs fail on the unique username, which is fine
+    await client.post("/users/", json={"username": username, "email": f"{username}@example.com", "password": password})
+
+
+async def worker(client, args, deadline, book_ids, timings, errors):
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < args.login_ratio:
+            name, request = "POST /token", client.post(
+                "/token", data={"username": args.username, "password": args.password}
+            )
+        elif roll < args.login_ratio + (1 - args.login_ratio) / 2:
+            name, request = "GET /books/", client.get("/books/", params={"limit": 50})
+        else:
+            name, request = "GET /books/{id}", client.get(f"/books/{rng.choice(book_ids)}")
+        start = time.perf_counter()
+        try:
+            response = await request
+            if response.status_code >= 500:
+                errors[name] += 1
+        except httpx.HTTPError:
+            errors[name] += 1
+            continue
+        timings[name].append((time.perf_counter() - start) * 1000)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        await ensure_user(client, args.username, args.password)
+        books = (await client.get("/books/", params={"limit": 200})).json()
+        book_ids = [book["id"] for book in books] or [1]
+
+        timings = defaultdict(list)
+        errors = defaultdict(int)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            worker(client, args, deadline, book_ids, timings, errors) for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in timings.values())
+    print(f"{total} requests in {elapsed:.1f}s with {args.concurrency} clients: {total / elapsed:.1f} req/s")
+    print(f"{'endpoint':<18} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in sorted(timings):
+        values = sorted(timings[name])
+        print(f"{name:<18} {len(values):>7} {len(values) / elapsed:>8.1f} "
+              f"{statistics.median(values):>8.1f} {percentile(values, 0.99):>8.1f} {errors[name]:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--login-ratio", type=float, default=0.1, help="share of requests that log in")
+    parser.add_argument("--username", default="loadtest")
+    parser.add_argument("--password", default="loadtest-password")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
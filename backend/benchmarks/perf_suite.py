@@ -0,0 +1,316 @@
+"""Reproducible API performance suite with baselines that can be diffed.
+
+Seeds a database with a synthetic catalogue (written in the backend/data/mock.csv
+format and loaded through the bulk importer), users and reading lists, then
+measures throughput and p50/p95/p99 latency per endpoint:
+
+    GET /books/, GET /books/{id}, GET /books/{id}/similar, GET /books/search/, POST /token,
+    GET, POST and DELETE on /users/{id}/books/...
+
+in two modes: "inprocess" drives the ASGI app directly through httpx, without
+a network or server in the way, and "uvicorn" starts a local server and
+drives it with concurrent clients. Run from the repository root:
+
+    python -m backend.benchmarks.perf_suite --books 20000 --save baseline.json
+    # ... change something ...
+    python -m backend.benchmarks.perf_suite --books 20000 --compare baseline.json
+
+Without --database-url a throwaway SQLite file is used; pass a local Postgres
+URL to measure against Postgres. Every table of the target database is dropped
+and recreated unless --skip-seed is given. Logins run bcrypt, so /token gets a
+tenth of the requests of the other endpoints.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from backend.benchmarks.load_test import percentile
+from backend.benchmarks.search_benchmark import GENRES, make_words
+
+PASSWORD = "perf-suite-password"
+ENDPOINTS = [
+    "GET /books/",
+    "GET /books/{id}",
+    "GET /books/{id}/similar",
+    "GET /books/search/",
+    "POST /token",
+    "GET /users/{id}/books/",
+    "POST /users/{id}/books/{book_id}/",
+    "DELETE /users/{id}/books/{book_id}/",
+]
+
+
+def write_catalogue(path, size, rng, words):
+    """A synthetic catalogue with the columns of backend/data/mock.csv."""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "title", "author", "genre", "rating", "image_url"])
+        for book_id in range(1, size + 1):
+            writer.writerow([
+                book_id,
+                " ".join(rng.choice(words) for _ in range(rng.randint(1, 4))).title(),
+                f"{rng.choice(words).title()} {rng.choice(words).title()}",
+                rng.choice(GENRES),
+                round(rng.uniform(1, 5), 1),
+                f"https://example.com/images/{book_id}.jpg",
+            ])
+
+
+async def seed(args, rng, words):
+    from backend.src import importer, models, ranking, recommend
+    from backend.src.database import engine
+    from backend.src.passwords import hasher
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "catalogue.csv")
+        write_catalogue(path, args.books, rng, words)
+        stats = importer.import_books(engine, path)
+    # One hash for every user: seeding must not spend minutes in bcrypt
+    hashed_password = await hasher.hash(PASSWORD)
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@example.com",
+             "hashed_password": hashed_password}
+            for user_id in range(1, args.users + 1)
+        ])
+        saves = min(args.saves_per_user, args.books)
+        connection.execute(models.UserBook.__table__.insert(), [
+            {"user_id": user_id, "book_id": book_id}
+            for user_id in range(1, args.users + 1)
+            for book_id in rng.sample(range(1, args.books + 1), saves)
+        ])
+        if engine.dialect.name == "postgresql":
+            connection.exec_driver_sql(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), coalesce(max(id), 1)) FROM users"
+            )
+        ranking.rebuild(connection)
+    # Built offline, as in production; the server then only applies logged changes
+    if recommend.similarity_index.acquire_writer():
+        with engine.begin() as connection:
+            recommend.similarity_index.build(connection)
+        recommend.similarity_index.release_writer()
+    engine.dispose()
+    print(f"seeded {stats.imported} books ({stats.rows_per_second:.0f} rows/s), {args.users} users, "
+          f"{args.users * saves} saved books", file=sys.stderr)
+
+
+def make_request(name, args, rng, words):
+    """(method, url, httpx keyword arguments) for one request to endpoint name."""
+    user_id = rng.randint(1, args.users)
+    book_id = rng.randint(1, args.books)
+    if name == "GET /books/":
+        return "GET", "/books/", {"params": {"skip": rng.randrange(max(1, args.books - 50)), "limit": 50}}
+    if name == "GET /books/{id}":
+        return "GET", f"/books/{book_id}", {}
+    if name == "GET /books/{id}/similar":
+        return "GET", f"/books/{book_id}/similar", {}
+    if name == "GET /books/search/":
+        return "GET", "/books/search/", {"params": {"q": rng.choice(words)}}
+    if name == "POST /token":
+        return "POST", "/token", {"data": {"username": f"user{user_id}", "password": PASSWORD}}
+    if name == "GET /users/{id}/books/":
+        page = rng.sample(range(1, args.books + 1), min(50, args.books))
+        return "GET", f"/users/{user_id}/books/", {"params": {"book_ids": page}}
+    if name == "POST /users/{id}/books/{book_id}/":
+        return "POST", f"/users/{user_id}/books/{book_id}/", {}
+    if name == "DELETE /users/{id}/books/{book_id}/":
+        return "DELETE", f"/users/{user_id}/books/{book_id}/", {}
+    raise ValueError(name)
+
+
+async def measure_endpoint(client, name, count, concurrency, args, rng, words):
+    requests = [make_request(name, args, rng, words) for _ in range(count)]
+    timings, errors = [], 0
+
+    async def worker(batch):
+        nonlocal errors
+        for method, url, options in batch:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **options)
+                # 404s are expected: removing a book that is not in the list
+                if response.status_code >= 500 or response.status_code in (400, 401, 422):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(requests[index::concurrency]) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    timings.sort()
+    if not timings:
+        return {"count": 0, "errors": errors}
+    return {
+        "count": len(timings),
+        "errors": errors,
+        "throughput": round(len(timings) / elapsed, 1),
+        "mean": round(statistics.fmean(timings), 2),
+        "p50": round(statistics.median(timings), 2),
+        "p95": round(percentile(timings, 0.95), 2),
+        "p99": round(percentile(timings, 0.99), 2),
+    }
+
+
+async def run_suite(client, args, concurrency, rng, words):
+    results = {}
+    for name in ENDPOINTS:
+        count = max(1, args.requests // 10) if name == "POST /token" else args.requests
+        # Warm up connections, caches and the search index before measuring
+        await measure_endpoint(client, name, min(count, 5), 1, args, rng, words)
+        results[name] = await measure_endpoint(client, name, count, concurrency, args, rng, words)
+    return results
+
+
+async def run_inprocess(args, rng, words):
+    # Imported late: the database module reads DATABASE_URL at import time
+    from backend.src.main import app
+    from backend.src.database import async_engine
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://perf-suite", timeout=60) as client:
+        results = await run_suite(client, args, args.inprocess_concurrency, rng, words)
+    await async_engine.dispose()
+    return results
+
+
+async def run_uvicorn(args, rng, words):
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.src.main:app", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    if (await client.get("/books/", params={"limit": 1})).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start")
+                await asyncio.sleep(0.2)
+            return await run_suite(client, args, args.concurrency, rng, words)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def print_results(mode, results):
+    print(f"\n[{mode}]")
+    print(f"{'endpoint':<38} {'count':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for name, result in results.items():
+        if not result["count"]:
+            print(f"{name:<38} {0:>6} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {result['errors']:>6}")
+            continue
+        print(f"{name:<38} {result['count']:>6} {result['throughput']:>8.1f} {result['p50']:>8.2f} "
+              f"{result['p95']:>8.2f} {result['p99']:>8.2f} {result['errors']:>6}")
+
+
+def compare(report, baseline, max_regression):
+    """Print the change of each metric against baseline; return the regressions beyond max_regression %."""
+    regressions = []
+    print(f"\nchange against baseline ({baseline['meta'].get('timestamp', '?')}); "
+          "latency up or throughput down is worse")
+    print(f"{'mode':<10} {'endpoint':<38} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for mode, results in report["results"].items():
+        for name, result in results.items():
+            before = baseline["results"].get(mode, {}).get(name)
+            if not before or not before.get("count") or not result.get("count"):
+                continue
+            changes = {key: (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                       for key in ("throughput", "p50", "p95", "p99")}
+            print(f"{mode:<10} {name:<38} " + " ".join(f"{changes[key]:>+8.1f}%" for key in changes))
+            if changes["p95"] > max_regression or -changes["throughput"] > max_regression:
+                regressions.append((mode, name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--saves-per-user", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=300, help="requests per endpoint")
+    parser.add_argument("--inprocess-concurrency", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients against uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data already in --database-url")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON, e.g. a new baseline")
+    parser.add_argument("--compare", metavar="PATH", help="baseline JSON to diff the results against")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="with --compare, exit with status 1 if a p95 or throughput is this many %% worse")
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.database_url:
+        if args.skip_seed:
+            parser.error("--skip-seed needs --database-url")
+        workdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(workdir.name, 'perf_suite.db')}"
+        # The similar-books index belongs to this database, not the machine-wide default
+        os.environ.setdefault("RECOMMEND_DIR", os.path.join(workdir.name, "recommend"))
+    os.environ["DATABASE_URL"] = args.database_url
+
+    rng = random.Random(args.seed)
+    words = make_words(rng)
+    if not args.skip_seed:
+        asyncio.run(seed(args, rng, words))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "database": args.database_url.partition(":")[0],
+            "python": platform.python_version(),
+            **{name: getattr(args, name) for name in
+               ("books", "users", "requests", "inprocess_concurrency", "concurrency", "workers", "seed")},
+        },
+        "results": {},
+    }
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        # Same request sequence in every run with the same --seed
+        mode_rng = random.Random(f"{args.seed}:{mode}")
+        runner = run_inprocess if mode == "inprocess" else run_uvicorn
+        report["results"][mode] = asyncio.run(runner(args, mode_rng, words))
+        print_results(mode, report["results"][mode])
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    status = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.max_regression)
+        for mode, name in regressions:
+            print(f"regression: {mode} {name}", file=sys.stderr)
+        status = 1 if regressions else 0
+    if workdir:
+        workdir.cleanup()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Compare the legacy ILIKE book search with the indexed search engine.
+
+Seeds a synthetic catalogue at each requested size and reports p50/p99 latency
+of both paths for the same query terms. Run from the repository root:
+
+    python -m backend.benchmarks.search_benchmark --sizes 10000 100000 1000000
+
+Without --database-url a throwaway SQLite file is used (exercising the
+in-process fallback index); pass a Postgres URL to benchmark tsvector/pg_trgm.
+Every table of the target database is dropped and recreated.
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import statistics
+import tempfile
+import time
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vor", "shi", "dan", "el", "mor", "qu", "is", "an", "th", "ber", "gat"]
+GENRES = ["Fiction", "Science Fiction", "Fantasy", "Mystery", "Romance", "History", "Biography", "Poetry"]
+
+
+def make_words(rng, count=3000):
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(engine, models, size, rng, words, batch_size=10000):
+    from backend.src import facets
+
+    # The whole schema: books references genres and authors, and user_books references books
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    table = models.Book.__table__
+    with engine.begin() as connection:
+        for start in range(0, size, batch_size):
+            connection.execute(table.insert(), [
+                {
+                    "id": i + 1,
+                    "title": " ".join(rng.choice(words) for _ in range(rng.randint(1, 4))).title(),
+                    "author": f"{rng.choice(words).title()} {rng.choice(words).title()}",
+                    "genre": rng.choice(GENRES),
+                    "rating": round(rng.uniform(1, 5), 1),
+                }
+                for i in range(start, min(start + batch_size, size))
+            ])
+        # Fills genre_id and author_id, so queries run against the normalized schema
+        facets.rebuild(connection)
+        if engine.dialect.name == "postgresql":
+            connection.exec_driver_sql("ANALYZE books")
+
+
+def make_queries(rng, words, count):
+    queries = []
+    for _ in range(count):
+        word = rng.choice(words)
+        if rng.random() < 0.2 and len(word) > 4:
+            # Swap two letters to simulate a typo
+            i = rng.randrange(len(word) - 1)
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        queries.append(word)
+    return queries
+
+
+async def measure(fn, queries):
+    timings = []
+    for term in queries:
+        start = time.perf_counter()
+        result = fn(term)
+        if inspect.isawaitable(result):
+            await result
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20, help="page size for the indexed search")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.database_url:
+        workdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(workdir.name, 'search_benchmark.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+
+    asyncio.run(run(args))
+    if workdir:
+        workdir.cleanup()
+
+
+async def run(args):
+    # Imported late: the database module reads DATABASE_URL at import time
+    from backend.src import models, search
+    from backend.src.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+
+    rng = random.Random(args.seed)
+    words = make_words(rng)
+    print(f"{'books':>9}  {'path':<8} {'p50 ms':>9} {'p99 ms':>9}")
+    for size in args.sizes:
+        seed(engine, models, size, rng, words)
+        queries = make_queries(rng, words, args.queries)
+        with SessionLocal() as sync_db:
+            async with AsyncSessionLocal() as db:
+                def legacy(term):
+                    return sync_db.query(models.Book).filter(models.Book.title.ilike(f"%{term}%")).all()
+
+                def indexed(term):
+                    return search.search_books(db, q=term, limit=args.limit)
+
+                if engine.dialect.name != "postgresql":
+                    start = time.perf_counter()
+                    search._fallback_index.load(sync_db)
+                    print(f"{size:>9}  index build {time.perf_counter() - start:.2f}s")
+                for name, fn in (("ilike", legacy), ("indexed", indexed)):
+                    await measure(fn, queries[:1])  # warm up caches and the connection
+                    p50, p99 = await measure(fn, queries)
+                    print(f"{size:>9}  {name:<8} {p50:>9.2f} {p99:>9.2f}")
+            sync_db.expunge_all()
+
+    engine.dispose()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Compare the ways a page of books can be turned into a JSON response body.
+
+Seeds a synthetic catalogue and reports, per page of books, the time to fetch
+and encode it along each path, and the time spent encoding alone:
+
+    legacy    ORM objects -> schemas.Book -> jsonable_encoder -> json
+    orm       ORM objects -> dicts -> serialization.dumps
+    columns   column rows -> dicts -> serialization.dumps
+    summary   column rows of the summary fields -> dicts -> serialization.dumps
+
+Run from the repository root:
+
+    python -m backend.benchmarks.serialization_benchmark --books 20000 --page-size 1000
+
+Without --database-url a throwaway SQLite file is used. Every table of the
+target database is dropped and recreated.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from backend.benchmarks.search_benchmark import make_words, seed
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+async def timed_async(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--books", type=int, default=20000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.database_url:
+        workdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(workdir.name, 'serialization_benchmark.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+
+    asyncio.run(run(args))
+    if workdir:
+        workdir.cleanup()
+
+
+async def run(args):
+    # Imported late: the database module reads DATABASE_URL at import time
+    from fastapi.encoders import jsonable_encoder
+    from sqlalchemy import select
+
+    from backend.src import crud, models, schemas, serialization
+    from backend.src.database import AsyncSessionLocal, async_engine, engine
+
+    rng = random.Random(args.seed)
+    seed(engine, models, args.books, rng, make_words(rng))
+    fields = schemas.field_names(schemas.Book)
+    summary = schemas.field_names(schemas.BookSummary)
+    print(f"encoder: {'orjson' if serialization.orjson else 'json (orjson not installed)'}")
+
+    async with AsyncSessionLocal() as db:
+        async def fetch_orm():
+            offset = rng.randrange(max(1, args.books - args.page_size))
+            books = (await db.scalars(
+                select(models.Book).order_by(models.Book.id).offset(offset).limit(args.page_size)
+            )).all()
+            # Fresh objects on every fetch, as in a request with its own session
+            db.expunge_all()
+            return books
+
+        async def fetch_rows(names):
+            offset = rng.randrange(max(1, args.books - args.page_size))
+            return (await db.execute(
+                select(*crud.book_columns(names)).order_by(models.Book.id).offset(offset).limit(args.page_size)
+            )).all()
+
+        def legacy(books):
+            items = [schemas.from_orm(schemas.Book, book) for book in books]
+            return json.dumps(jsonable_encoder(items), separators=(",", ":")).encode()
+
+        def plain(books, names):
+            return serialization.dumps(serialization.book_dicts(books, names))
+
+        paths = [
+            ("legacy", fetch_orm, legacy),
+            ("orm", fetch_orm, lambda books: plain(books, fields)),
+            ("columns", lambda: fetch_rows(fields), lambda rows: plain(rows, fields)),
+            ("summary", lambda: fetch_rows(summary), lambda rows: plain(rows, summary)),
+        ]
+        print(f"{'path':<8} {'total ms':>9} {'encode ms':>10} {'bytes':>9}   per {args.page_size} books")
+        for name, fetch, encode in paths:
+            async def fetch_and_encode():
+                return encode(await fetch())
+
+            await fetch_and_encode()  # warm up caches and the connection
+            total, _ = await timed_async(fetch_and_encode, args.repeat)
+            books = await fetch()
+            encoding, body = timed(lambda: encode(books), args.repeat)
+            print(f"{name:<8} {total:>9.2f} {encoding:>10.2f} {len(body):>9}")
+
+    engine.dispose()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
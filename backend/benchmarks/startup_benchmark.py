@@ -0,0 +1,104 @@
+"""Measure time to first response of a freshly started API server.
+
+Starts the server repeatedly in each configuration and records, per start, the
+time from spawning the process to the first successful response of --path,
+and the latency of the request after it. Run from the repository root:
+
+    python -m backend.benchmarks.startup_benchmark --runs 5
+    python -m backend.benchmarks.startup_benchmark --database-url postgresql://... --runs 5
+
+Configurations:
+
+    uvicorn          a single uvicorn process, schema managed by migrations
+    uvicorn+schema   the same, creating the schema on startup (what importing
+                     main.py used to do unconditionally)
+    gunicorn         backend/gunicorn.conf.py: preloaded app, uvicorn workers
+
+Without --database-url a throwaway SQLite file is used, with the schema created
+up front as the release phase's migration would.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+CONFIGURATIONS = {
+    "uvicorn": (["-m", "uvicorn", "backend.src.main:app", "--log-level", "warning", "--port", "{port}"],
+                {"DB_CREATE_SCHEMA": "false"}),
+    "uvicorn+schema": (["-m", "uvicorn", "backend.src.main:app", "--log-level", "warning", "--port", "{port}"],
+                       {"DB_CREATE_SCHEMA": "true"}),
+    "gunicorn": (["-m", "gunicorn", "backend.src.main:app", "-c", "backend/gunicorn.conf.py", "--log-level", "warning"],
+                 {"DB_CREATE_SCHEMA": "false", "PORT": "{port}", "GUNICORN_ACCESS_LOG": ""}),
+}
+
+
+def start_once(name, args):
+    command, env = CONFIGURATIONS[name]
+    port = str(args.port)
+    env = {**os.environ, **{key: value.format(port=port) for key, value in env.items()}}
+    url = f"http://127.0.0.1:{port}{args.path}"
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, *(part.format(port=port) for part in command)], env=env)
+    try:
+        with httpx.Client(timeout=10) as client:
+            while True:
+                try:
+                    if client.get(url).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if server.poll() is not None:
+                    raise RuntimeError(f"{name} exited with status {server.returncode}")
+                if time.perf_counter() - started > args.timeout:
+                    raise RuntimeError(f"{name} did not answer within {args.timeout}s")
+                time.sleep(0.005)
+            first = time.perf_counter() - started
+            start = time.perf_counter()
+            client.get(url)
+            second = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return first * 1000, second * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite database")
+    parser.add_argument("--configurations", nargs="+", choices=list(CONFIGURATIONS), default=list(CONFIGURATIONS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/books/?limit=1", help="request that must succeed")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each start")
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.database_url:
+        workdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(workdir.name, 'startup_benchmark.db')}"
+        os.environ["DATABASE_URL"] = args.database_url
+        # Imported late: the database module reads DATABASE_URL at import time
+        from backend.src import models
+        from backend.src.database import engine
+
+        models.Base.metadata.create_all(bind=engine)
+        engine.dispose()
+    os.environ["DATABASE_URL"] = args.database_url
+
+    print(f"{'configuration':<16} {'first ms':>9} {'min':>9} {'max':>9} {'next req ms':>12}")
+    for name in args.configurations:
+        results = [start_once(name, args) for _ in range(args.runs)]
+        firsts = [first for first, _ in results]
+        print(f"{name:<16} {statistics.median(firsts):>9.0f} {min(firsts):>9.0f} {max(firsts):>9.0f} "
+              f"{statistics.median(second for _, second in results):>12.1f}")
+    if workdir:
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Production server: gunicorn managing uvicorn workers.
+
+    gunicorn backend.src.main:app -c backend/gunicorn.conf.py
+
+The app is imported once in the master and forked into the workers (preload),
+so workers start in milliseconds and share the imported code's memory. Each
+worker runs the app's lifespan after the fork, where database connections are
+opened. Heroku sets PORT and WEB_CONCURRENCY.
+
+Workers share nothing but the database. With the default per-process memory
+cache, invalidation only reaches the worker that handled the write, and the
+others would serve stale books and search results until CACHE_TTL. Several
+workers therefore require a shared response cache (CACHE_BACKEND=redis, or
+none): the server refuses to start with WEB_CONCURRENCY above 1 and the memory
+cache, rather than quietly running one worker on a dyno sized for more. Without
+WEB_CONCURRENCY, the default is 2 workers with a shared cache and 1 without.
+The principal cache and the SQLite fallback search index stay per process
+either way: keep one worker when running on SQLite.
+"""
+import os
+
+from backend.src.cache import CACHE_BACKEND
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or (1 if CACHE_BACKEND == "memory" else 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Heroku's router gives up after 30 seconds
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 20
+# Outlive the router's idle connections, so it never reuses one the worker has just closed
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+# Recycle workers now and then, staggered so they do not all restart together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10
+
+# Request logs to stdout; set GUNICORN_ACCESS_LOG to an empty value to turn them off
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+
+
+def on_starting(server):
+    if server.num_workers > 1 and CACHE_BACKEND == "memory":
+        server.log.error(
+            "Refusing to start %d workers with the per-process memory cache: they would serve "
+            "stale responses after writes. Set CACHE_BACKEND=redis (with REDIS_URL), or WEB_CONCURRENCY=1.",
+            server.num_workers,
+        )
+        raise SystemExit(1)
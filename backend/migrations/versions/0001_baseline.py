@@ -0,0 +1,54 @@
+"""Baseline: the schema as originally created by Base.metadata.create_all
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-12-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String()),
+        sa.Column("email", sa.String()),
+        sa.Column("hashed_password", sa.String()),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "books",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String()),
+        sa.Column("author", sa.String()),
+        sa.Column("genre", sa.String()),
+        sa.Column("rating", sa.Float()),
+        sa.Column("image_url", sa.String()),
+        sa.Column("description", sa.String()),
+    )
+    for column in ("id", "title", "author", "genre"):
+        op.create_index(f"ix_books_{column}", "books", [column])
+
+    op.create_table(
+        "user_books",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("book_id", sa.Integer(), sa.ForeignKey("books.id")),
+    )
+    op.create_index("ix_user_books_id", "user_books", ["id"])
+
+
+def downgrade():
+    op.drop_table("user_books")
+    op.drop_table("books")
+    op.drop_table("users")
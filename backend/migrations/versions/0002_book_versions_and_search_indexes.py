@@ -0,0 +1,44 @@
+"""Book version/updated_at columns, rating keyset index and search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-01-15 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+SEARCH_DOCUMENT = (
+    "to_tsvector('simple'::regconfig, "
+    "coalesce(title, '') || ' ' || coalesce(author, '') || ' ' || coalesce(genre, ''))"
+)
+
+
+def upgrade():
+    # Batch mode: SQLite cannot add a column with a non-constant default in place
+    with op.batch_alter_table("books") as batch:
+        batch.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="1"))
+        batch.add_column(sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False,
+                                   server_default=sa.func.now()))
+    op.create_index("ix_books_rating_id", "books", ["rating", "id"])
+
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(f"CREATE INDEX IF NOT EXISTS ix_books_search_document ON books USING gin ({SEARCH_DOCUMENT})")
+        for column in ("title", "author", "genre"):
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_books_{column}_trgm ON books USING gin ({column} gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        for name in ("ix_books_search_document", "ix_books_title_trgm", "ix_books_author_trgm", "ix_books_genre_trgm"):
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.drop_index("ix_books_rating_id", table_name="books")
+    with op.batch_alter_table("books") as batch:
+        batch.drop_column("updated_at")
+        batch.drop_column("version")
@@ -0,0 +1,31 @@
+"""Unique (user_id, book_id) on user_books and an index on book_id
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-01-20 00:00:00
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lists may hold the same book twice from before the constraint; keep the oldest row
+    op.execute(
+        "DELETE FROM user_books WHERE id NOT IN "
+        "(SELECT min(id) FROM user_books GROUP BY user_id, book_id)"
+    )
+    with op.batch_alter_table("user_books") as batch:
+        # Leading user_id also serves "all books of a user"
+        batch.create_unique_constraint("uq_user_books_user_id_book_id", ["user_id", "book_id"])
+        batch.create_index("ix_user_books_book_id", ["book_id"])
+
+
+def downgrade():
+    with op.batch_alter_table("user_books") as batch:
+        batch.drop_index("ix_user_books_book_id")
+        batch.drop_constraint("uq_user_books_user_id_book_id", type_="unique")
@@ -0,0 +1,66 @@
+"""Ranking aggregates: book save counts and scores, per-genre rating histograms
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-02-01 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+# Matches ranking.RANKING_PRIOR_WEIGHT's default; `python -m backend.src.ranking` rescores with the configured one
+PRIOR_WEIGHT = 10
+
+
+def upgrade():
+    with op.batch_alter_table("books") as batch:
+        batch.add_column(sa.Column("save_count", sa.Integer(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("score", sa.Float()))
+    op.create_index("ix_books_save_count_id", "books", ["save_count", "id"])
+    op.create_index("ix_books_score_id", "books", ["score", "id"])
+    op.create_index("ix_books_genre_save_count_id", "books", ["genre", "save_count", "id"])
+    op.create_index("ix_books_genre_score_id", "books", ["genre", "score", "id"])
+    op.create_table(
+        "genre_rating_buckets",
+        sa.Column("genre", sa.String(), primary_key=True),
+        sa.Column("bucket", sa.Integer(), primary_key=True),
+        sa.Column("book_count", sa.Integer(), nullable=False),
+    )
+
+    # Backfill from the existing data
+    op.execute(
+        "UPDATE books SET save_count = "
+        "(SELECT count(*) FROM user_books WHERE user_books.book_id = books.id)"
+    )
+    # Halves round up, as in ranking.rating_bucket; SQLite's CAST truncates, which is floor here
+    shifted = "rating * 10 + 0.5"
+    bucket = f"CAST(floor({shifted}) AS INTEGER)" if op.get_bind().dialect.name == "postgresql" else (
+        f"CAST({shifted} AS INTEGER)")
+    bucket = f"CASE WHEN {bucket} < 0 THEN 0 WHEN {bucket} > 50 THEN 50 ELSE {bucket} END"
+    op.execute(
+        "INSERT INTO genre_rating_buckets (genre, bucket, book_count) "
+        f"SELECT genre, {bucket}, count(*) FROM books "
+        "WHERE genre IS NOT NULL AND rating IS NOT NULL "
+        f"GROUP BY genre, {bucket}"
+    )
+    op.execute(
+        f"UPDATE books SET score = (save_count * rating + {PRIOR_WEIGHT} * "
+        "(SELECT coalesce(avg(rating), 3.0) FROM books)) "
+        f"/ (save_count + {PRIOR_WEIGHT}) WHERE rating IS NOT NULL AND save_count > 0"
+    )
+
+
+def downgrade():
+    op.drop_table("genre_rating_buckets")
+    op.drop_index("ix_books_genre_score_id", table_name="books")
+    op.drop_index("ix_books_genre_save_count_id", table_name="books")
+    op.drop_index("ix_books_score_id", table_name="books")
+    op.drop_index("ix_books_save_count_id", table_name="books")
+    with op.batch_alter_table("books") as batch:
+        batch.drop_column("score")
+        batch.drop_column("save_count")
@@ -0,0 +1,79 @@
+"""Normalized genres and authors with facet counters
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-02-10 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for name in ("genres", "authors"):
+        op.create_table(
+            name,
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False, unique=True),
+            sa.Column("book_count", sa.Integer(), nullable=False),
+        )
+        op.create_index(f"ix_{name}_book_count", name, ["book_count"])
+    op.create_table(
+        "genre_author_counts",
+        sa.Column("genre_id", sa.Integer(), sa.ForeignKey("genres.id"), primary_key=True),
+        sa.Column("author_id", sa.Integer(), sa.ForeignKey("authors.id"), primary_key=True),
+        sa.Column("book_count", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_genre_author_counts_genre_id_book_count", "genre_author_counts", ["genre_id", "book_count"])
+    op.create_index("ix_genre_author_counts_author_id_book_count", "genre_author_counts", ["author_id", "book_count"])
+
+    with op.batch_alter_table("books") as batch:
+        batch.add_column(sa.Column("author_id", sa.Integer()))
+        batch.add_column(sa.Column("genre_id", sa.Integer()))
+        batch.create_foreign_key("fk_books_author_id_authors", "authors", ["author_id"], ["id"])
+        batch.create_foreign_key("fk_books_genre_id_genres", "genres", ["genre_id"], ["id"])
+        batch.create_index("ix_books_author_id", ["author_id"])
+        batch.create_index("ix_books_genre_id", ["genre_id"])
+
+    if op.get_bind().dialect.name == "postgresql":
+        for name in ("genres", "authors"):
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_{name}_name_trgm ON {name} USING gin (name gin_trgm_ops)")
+
+    # Backfill from the existing free-text columns
+    for table, column in (("genres", "genre"), ("authors", "author")):
+        op.execute(
+            f"INSERT INTO {table} (name, book_count) "
+            f"SELECT trim({column}), 0 FROM books "
+            f"WHERE {column} IS NOT NULL AND trim({column}) <> '' GROUP BY trim({column})"
+        )
+        op.execute(
+            f"UPDATE books SET {column}_id = "
+            f"(SELECT id FROM {table} WHERE {table}.name = trim(books.{column}))"
+        )
+        op.execute(
+            f"UPDATE {table} SET book_count = "
+            f"(SELECT count(*) FROM books WHERE books.{column}_id = {table}.id)"
+        )
+    op.execute(
+        "INSERT INTO genre_author_counts (genre_id, author_id, book_count) "
+        "SELECT genre_id, author_id, count(*) FROM books "
+        "WHERE genre_id IS NOT NULL AND author_id IS NOT NULL GROUP BY genre_id, author_id"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("books") as batch:
+        batch.drop_index("ix_books_genre_id")
+        batch.drop_index("ix_books_author_id")
+        batch.drop_constraint("fk_books_genre_id_genres", type_="foreignkey")
+        batch.drop_constraint("fk_books_author_id_authors", type_="foreignkey")
+        batch.drop_column("genre_id")
+        batch.drop_column("author_id")
+    op.drop_table("genre_author_counts")
+    op.drop_table("authors")
+    op.drop_table("genres")
@@ -0,0 +1,31 @@
+"""Log of books whose similar-books vectors changed, read by every machine and pruned by age
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-03-03 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "similarity_changes",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("book_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        # Readers keep their position as an id, so ids must never be reused
+        sqlite_autoincrement=True,
+    )
+    op.create_index("ix_similarity_changes_created_at", "similarity_changes", ["created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_similarity_changes_created_at", table_name="similarity_changes")
+    op.drop_table("similarity_changes")
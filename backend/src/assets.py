@@ -0,0 +1,224 @@
+"""Static frontend assets: a build step and the layer that serves its output.
+
+The build copies frontend/ into frontend/dist/:
+- scripts, styles and images get a content hash in their name;
+- /static/ references in the CSS, scripts and HTML are rewritten to point at
+  the hashed names;
+- text files get gzip and brotli variants next to them.
+
+manifest.json maps each original path to its hashed name:
+
+    python -m backend.src.assets
+
+On Heroku the build runs from bin/post_compile while the slug is compiled, so
+dynos start with it in place instead of rebuilding on every boot.
+
+StaticAssets serves the result. Hashed files are immutable and cached by
+browsers for a year. Original names and HTML pages must be revalidated, which
+costs a 304. Precompressed variants are picked by Accept-Encoding, so nothing
+is compressed per request. Files go out through FileResponse, which hands the
+path to the server when it supports the ASGI pathsend extension. Without a
+build the source directory is served as is, for development.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import sys
+from dataclasses import dataclass, field
+
+from starlette.responses import FileResponse, PlainTextResponse, Response
+
+from .compression import COMPRESSIBLE_TYPES, _accepted_encodings, brotli
+from .http_caching import _etag_matches
+
+logger = logging.getLogger(__name__)
+
+FRONTEND_DIR = os.getenv("FRONTEND_DIR", "frontend")
+ASSETS_DIR = os.getenv("ASSETS_DIR", os.path.join(FRONTEND_DIR, "dist"))
+MANIFEST_NAME = "manifest.json"
+STATIC_PREFIX = "/static/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# Variants are only kept when they save at least this much
+MIN_COMPRESSION_SAVING = 0.1
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# Pages keep their URLs; everything they load is fingerprinted
+UNHASHED_EXTENSIONS = (".html",)
+REFERENCE_PATTERN = re.compile(r"/static/([A-Za-z0-9_./-]+)")
+
+
+def _media_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _source_files(directory, exclude):
+    """Relative paths of the files below directory, skipping the exclude directory."""
+    exclude = os.path.abspath(exclude)
+    for root, directories, files in os.walk(directory):
+        directories[:] = sorted(name for name in directories
+                                if os.path.abspath(os.path.join(root, name)) != exclude)
+        for name in sorted(files):
+            yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")
+
+
+def _rewrite(data, manifest):
+    def replace(match):
+        return STATIC_PREFIX + manifest.get(match.group(1), match.group(1))
+    return REFERENCE_PATTERN.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def _write_variants(path, data):
+    if not _media_type(path).startswith(COMPRESSIBLE_TYPES):
+        return
+    variants = {".gz": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    for suffix, compressed in variants.items():
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+            with open(path + suffix, "wb") as file:
+                file.write(compressed)
+
+
+def build(source=FRONTEND_DIR, output=ASSETS_DIR):
+    """Fingerprint, rewrite and precompress the frontend into output; return the manifest."""
+    paths = list(_source_files(source, output))
+    shutil.rmtree(output, ignore_errors=True)
+    manifest = {}
+    # Files that may reference others come after everything they could reference
+    def rewritten_last(path):
+        return (_media_type(path).startswith(COMPRESSIBLE_TYPES), path.endswith(UNHASHED_EXTENSIONS))
+    for path in sorted(paths, key=rewritten_last):
+        with open(os.path.join(source, path), "rb") as file:
+            data = file.read()
+        if _media_type(path).startswith(COMPRESSIBLE_TYPES):
+            data = _rewrite(data, manifest)
+        target = path
+        if not path.endswith(UNHASHED_EXTENSIONS):
+            stem, extension = os.path.splitext(path)
+            target = f"{stem}.{_content_hash(data)}{extension}"
+            manifest[path] = target
+        destination = os.path.join(output, target)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, "wb") as file:
+            file.write(data)
+        _write_variants(destination, data)
+    with open(os.path.join(output, MANIFEST_NAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+@dataclass
+class Asset:
+    path: str
+    media_type: str
+    etag: str
+    cache_control: str
+    stat: os.stat_result
+    # Content-Encoding -> (path, stat) of the precompressed variant
+    variants: dict = field(default_factory=dict)
+
+
+class StaticAssets:
+    """Serves a built asset directory, or the plain source directory when there is no build.
+
+    Every file is indexed once at startup, so requests never touch the
+    filesystem except to send the file itself.
+    """
+
+    def __init__(self, directory=ASSETS_DIR, fallback=FRONTEND_DIR):
+        build_directory = directory
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as file:
+                manifest = json.load(file)
+            self.built = True
+        else:
+            logger.info("No asset build in %s; serving %s unfingerprinted", directory, fallback)
+            directory, manifest = fallback, {}
+            self.built = False
+        self.directory = directory
+        self.manifest = manifest
+        # The build usually lives inside the source directory; never serve it unprocessed
+        self.assets = self._index(directory, manifest, exclude=build_directory)
+
+    def _index(self, directory, manifest, exclude):
+        hashed = set(manifest.values())
+        assets = {}
+        suffixes = tuple(ENCODING_SUFFIXES.values())
+        for path in _source_files(directory, exclude):
+            if path == MANIFEST_NAME or path.endswith(suffixes):
+                continue
+            full_path = os.path.join(directory, path)
+            with open(full_path, "rb") as file:
+                etag = f'"{_content_hash(file.read())}"'
+            asset = Asset(
+                path=full_path,
+                media_type=_media_type(path),
+                etag=etag,
+                cache_control=IMMUTABLE_CACHE_CONTROL if path in hashed else REVALIDATE_CACHE_CONTROL,
+                stat=os.stat(full_path),
+            )
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                if os.path.exists(full_path + suffix):
+                    asset.variants[encoding] = (full_path + suffix, os.stat(full_path + suffix))
+            assets[path] = asset
+        # Original names still work, but must be revalidated since their content can change
+        for original, target in manifest.items():
+            if target in assets:
+                assets[original] = Asset(**{**vars(assets[target]), "cache_control": REVALIDATE_CACHE_CONTROL})
+        return assets
+
+    def response(self, path, headers):
+        """Response for the asset at path, honouring Accept-Encoding and If-None-Match."""
+        asset = self.assets.get(path)
+        if asset is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        file_path, stat, etag = asset.path, asset.stat, asset.etag
+        response_headers = {"Cache-Control": asset.cache_control}
+        if asset.variants:
+            response_headers["Vary"] = "Accept-Encoding"
+        accepted = _accepted_encodings(headers.get("accept-encoding", ""))
+        for encoding in ENCODING_SUFFIXES:
+            if encoding in accepted and encoding in asset.variants:
+                file_path, stat = asset.variants[encoding]
+                response_headers["Content-Encoding"] = encoding
+                # Each encoding is a different byte sequence, so it gets its own strong validator
+                etag = f'{etag[:-1]}-{encoding}"'
+                break
+        response_headers["ETag"] = etag
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=response_headers)
+        return FileResponse(file_path, media_type=asset.media_type, headers=response_headers, stat_result=stat)
+
+    async def __call__(self, scope, receive, send):
+        # Mounted: the path below the mount point names the asset
+        path = scope["path"][len(scope.get("root_path", "")):].lstrip("/")
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        else:
+            response = self.response(path, headers)
+        await response(scope, receive, send)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    source = argv[0] if argv else FRONTEND_DIR
+    output = argv[1] if len(argv) > 1 else ASSETS_DIR
+    manifest = build(source, output)
+    print(f"Built {len(manifest)} fingerprinted assets into {output}")
+
+
+if __name__ == "__main__":
+    main()
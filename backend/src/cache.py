@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+try:
+    from redis.exceptions import WatchError
+except ImportError:  # only needed by the Redis backend
+    WatchError = None
+
+# "memory" (per process), "redis" (shared, needs REDIS_URL) or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+REDIS_URL = os.getenv("REDIS_URL")
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry TTL and tag-based invalidation.
+
+    Values are opaque bytes (serialized responses). Each entry may carry tags,
+    and invalidating a tag drops every entry carrying it. Every invalidation
+    also stamps its tags with a new generation, so that a value computed before
+    the invalidation can be refused when it is stored after it (see cached()).
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._generation = 0
+        self._tag_generations = {}
+        # Generations at or below this one were forgotten and count as invalidated
+        self._forgotten_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, _ = entry
+            if expires_at < time.monotonic():
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    async def generation(self):
+        with self._lock:
+            return self._generation
+
+    async def set(self, key, value, tags=(), ttl=None, since=None):
+        """Store value, unless since is given and one of tags was invalidated after that generation."""
+        with self._lock:
+            if since is not None and (
+                since < self._forgotten_generation
+                or any(self._tag_generations.get(tag, 0) > since for tag in tags)
+            ):
+                return False
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value, tuple(tags))
+            for tag in tags:
+                self._tags[tag].add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    async def invalidate(self, *tags):
+        with self._lock:
+            self._generation += 1
+            if len(self._tag_generations) > self.max_entries:
+                # Only responses still being produced need them; those just won't be stored
+                self._tag_generations.clear()
+                self._forgotten_generation = self._generation - 1
+            for tag in tags:
+                self._tag_generations[tag] = self._generation
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._discard(key)
+                        self.invalidations += 1
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._tag_generations.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def stats(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class RedisCache:
+    """Cache stored in Redis, shared by every worker.
+
+    Works with any client exposing the redis.asyncio API, including
+    fakeredis.aioredis.FakeRedis for local testing. Tags are Redis sets holding
+    the keys of their entries. Evictions are Redis's own evicted_keys counter.
+    Invalidations increment a shared generation counter and record it per tag;
+    a conditional set watches those tag generations so that it fails if an
+    invalidation lands between its check and the write.
+    """
+
+    name = "redis"
+
+    def __init__(self, client, prefix="litrank:cache:", ttl=CACHE_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _tag(self, tag):
+        return f"{self.prefix}tag:{tag}"
+
+    def _tag_generation(self, tag):
+        return f"{self.prefix}generation:{tag}"
+
+    async def generation(self):
+        return int(await self.client.get(f"{self.prefix}generation") or 0)
+
+    async def get(self, key):
+        value = await self.client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value, tags=(), ttl=None, since=None):
+        """Store value, unless since is given and one of tags was invalidated after that generation."""
+        ttl = ttl or self.ttl
+        async with self.client.pipeline(transaction=since is not None) as pipe:
+            if since is not None:
+                generation_keys = [self._tag_generation(tag) for tag in tags]
+                if generation_keys:
+                    await pipe.watch(*generation_keys)
+                    generations = await pipe.mget(*generation_keys)
+                    if any(int(generation or 0) > since for generation in generations):
+                        return False
+                pipe.multi()
+            pipe.set(self._key(key), value, px=int(ttl * 1000))
+            for tag in tags:
+                pipe.sadd(self._tag(tag), self._key(key))
+                # Tag sets outlive their entries slightly; stale members only cost a no-op DEL
+                pipe.pexpire(self._tag(tag), int(ttl * 2000))
+            try:
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    async def invalidate(self, *tags):
+        generation = await self.client.incr(f"{self.prefix}generation")
+        async with self.client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                # Only needs to outlive the responses being computed right now
+                pipe.set(self._tag_generation(tag), generation, px=int(self.ttl * 2000))
+            await pipe.execute()
+        for tag in tags:
+            keys = await self.client.smembers(self._tag(tag))
+            if keys:
+                self.invalidations += await self.client.delete(*keys)
+            await self.client.delete(self._tag(tag))
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=f"{self.prefix}*"):
+            await self.client.delete(key)
+
+    async def stats(self):
+        try:
+            evictions = (await self.client.info("stats")).get("evicted_keys", 0)
+        except Exception:
+            # Servers and fakes without INFO support
+            evictions = None
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class NullCache:
+    """Disables caching while keeping the same interface."""
+
+    name = "none"
+
+    async def get(self, key):
+        return None
+
+    async def generation(self):
+        return 0
+
+    async def set(self, key, value, tags=(), ttl=None, since=None):
+        return False
+
+    async def invalidate(self, *tags):
+        pass
+
+    async def clear(self):
+        pass
+
+    async def stats(self):
+        return {"backend": self.name}
+
+
+def build_cache(backend=CACHE_BACKEND):
+    if backend == "redis":
+        # Optional dependency, only needed when the Redis backend is selected
+        import redis.asyncio
+        return RedisCache(redis.asyncio.from_url(REDIS_URL))
+    if backend == "none":
+        return NullCache()
+    return MemoryCache()
+
+
+response_cache = build_cache()
+
+
+async def cached(key, produce, ttl=None):
+    """Return (body, meta) for key.
+
+    On a miss, produce() returns (body, tags, meta). meta is a small JSON-able
+    dict, such as HTTP validators, stored in front of the body. A body is not
+    stored when one of its tags was invalidated while it was being produced:
+    it may predate the write that invalidated it.
+    """
+    value = await response_cache.get(key)
+    if value is not None:
+        header, _, body = value.partition(b"\n")
+        return body, json.loads(header)
+    generation = await response_cache.generation()
+    body, tags, meta = await produce()
+    await response_cache.set(key, json.dumps(meta).encode() + b"\n" + body, tags=tags, ttl=ttl, since=generation)
+    return body, meta
+
+
+# Cache tags for book data. Detail responses and every list page carry the tag
+# of each book they contain, so an update invalidates exactly those entries.
+def book_tag(book_id):
+    return f"book:{book_id}"
+
+
+# Offset-paginated /books/ pages shift whenever a book is created or deleted
+BOOK_LISTS_TAG = "books:list"
+# Last page of the id ordering, the only keyset page a new book can join
+BOOK_PAGE_TAIL_TAG = "books:page:id:tail"
+# Rating-ordered pages, reshuffled whenever a rating changes
+BOOK_PAGES_BY_RATING_TAG = "books:page:rating"
+# Search results can change with any book's title, author, genre or rating
+BOOK_SEARCH_TAG = "books:search"
+# Ranked listings and genre statistics, which also move with every save
+BOOK_RANKINGS_TAG = "books:rankings"
@@ -0,0 +1,180 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+def _accepted_encodings(header):
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def _vary_accept_encoding(headers):
+    """headers with Accept-Encoding listed in Vary, merged into an existing Vary header."""
+    for index, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" in value.lower() or value.strip() == b"*":
+                return headers
+            return [*headers[:index], (name, value + b", Accept-Encoding"), *headers[index + 1:]]
+    return [*headers, (b"vary", b"Accept-Encoding")]
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level):
+        # wbits=31 produces the gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compresses responses with brotli or gzip, based on Accept-Encoding.
+
+    Bodies below minimum_size, already-encoded responses and non-text content
+    types pass through untouched. Streaming responses are compressed chunk by
+    chunk and flushed after each one so that NDJSON rows still arrive promptly.
+    Every response that could have been compressed carries Vary: Accept-Encoding,
+    including the ones sent as is, so shared caches keep the variants apart.
+    """
+
+    def __init__(self, app, minimum_size=500, gzip_level=6, brotli_quality=4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accepted = _accepted_encodings(
+            dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        )
+        if brotli is not None and "br" in accepted:
+            make_encoder = lambda: _BrotliEncoder(self.brotli_quality)
+        elif "gzip" in accepted:
+            make_encoder = lambda: _GzipEncoder(self.gzip_level)
+        else:
+            # Nothing to compress with, but the response still varies on the header
+            make_encoder = None
+        await _CompressedResponder(self.app, self.minimum_size, make_encoder)(scope, receive, send)
+
+
+class _CompressedResponder:
+    def __init__(self, app, minimum_size, make_encoder):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.make_encoder = make_encoder
+        self.send = None
+        self.start_message = None
+        self.encoder = None
+        self.passthrough = False
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    def _compressible(self, headers):
+        if b"content-encoding" in headers:
+            return False
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            if not self._compressible(dict(headers)):
+                self.passthrough = True
+                await self.send(message)
+                return
+            message = {**message, "headers": _vary_accept_encoding(headers)}
+            if self.make_encoder is None:
+                self.passthrough = True
+                await self.send(message)
+                return
+            # Hold the start message until the first body chunk shows how large the response is
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            # pathsend and other extensions carry the body themselves; send it as is
+            if self.start_message is not None:
+                start, self.start_message = self.start_message, None
+                self.passthrough = True
+                await self.send(start)
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            self.encoder = self.make_encoder()
+            headers = [(name, value) for name, value in start.get("headers", [])
+                       if name.lower() not in (b"content-length", b"etag")]
+            etag = dict(start.get("headers", [])).get(b"etag")
+            if etag is not None:
+                # The compressed bytes differ from the identity representation
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            headers.append((b"content-encoding", self.encoder.name.encode()))
+            if not more_body:
+                compressed = self.encoder.compress(body) + self.encoder.finish()
+                headers.append((b"content-length", str(len(compressed)).encode()))
+                await self.send({**start, "headers": headers})
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            await self.send({**start, "headers": headers})
+
+        if self.passthrough:
+            await self.send(message)
+            return
+        if more_body:
+            chunk = self.encoder.compress(body) + self.encoder.flush()
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": True})
+        else:
+            chunk = self.encoder.compress(body) + self.encoder.finish()
+            await self.send({"type": "http.response.body", "body": chunk})
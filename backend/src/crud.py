@@ -1,28 +1,93 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_books(db: Session, skip: int = 0, limit: int = 50):
-    return db.query(models.Book).offset(skip).limit(limit).all()
-
-def get_book(db: Session, book_id: int):
-    return db.query(models.Book).filter(models.Book.id == book_id).first()  
-
-def search_books(db: Session, title: str = None, author: str = None, genre: str = None, rating: float = None):
-    query = db.query(models.Book)
-    if title:
-        query = query.filter(models.Book.title.ilike(f"%{title}%"))
-    if author:
-        query = query.filter(models.Book.author.ilike(f"%{author}%"))
-    if genre:
-        query = query.filter(models.Book.genre.ilike(f"%{genre}%"))
-    if rating:
-        query = query.filter(models.Book.rating >= rating)
-    return query.all()
-
-def create_book(db: Session, book: schemas.BookCreate):
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, search, pagination, ranking, facets, recommend
+from .cache import (
+    BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_RANKINGS_TAG, BOOK_SEARCH_TAG, book_tag,
+    response_cache,
+)
+from .passwords import hasher
+from .principals import principal_cache
+
+def book_columns(fields, *required):
+    """Columns to select for a projection of fields.
+
+    id is always included because cache tags are built from it, as are any
+    required columns (e.g. a cursor's keys).
+    """
+    names = dict.fromkeys(["id", *fields, *required])
+    return [getattr(models.Book, name) for name in names]
+
+async def get_books(db: AsyncSession, skip: int = 0, limit: int = 50, fields=None):
+    """Books as ORM objects, or as rows of only the given fields' columns."""
+    if fields is None:
+        result = await db.scalars(select(models.Book).offset(skip).limit(limit))
+        return result.all()
+    result = await db.execute(select(*book_columns(fields)).order_by(models.Book.id).offset(skip).limit(limit))
+    return result.all()
+
+def _keyset_statement(statement, order: str, cursor: str = None):
+    if order == "id":
+        if cursor:
+            (book_id,) = pagination.decode_cursor(order, cursor)
+            statement = statement.where(models.Book.id > book_id)
+        return statement.order_by(models.Book.id)
+    # Every other ordering is descending on (column, id)
+    column = getattr(models.Book, pagination.BOOK_ORDERINGS[order][0])
+    # Books without a value (e.g. unrated) have no position in the ordering
+    statement = statement.where(column.isnot(None))
+    if cursor:
+        value, book_id = pagination.decode_cursor(order, cursor)
+        statement = statement.where(tuple_(column, models.Book.id) < (value, book_id))
+    return statement.order_by(column.desc(), models.Book.id.desc())
+
+async def get_books_page(db: AsyncSession, order: str = "id", cursor: str = None, limit: int = 50,
+                         genre: str = None, fields=None):
+    if fields is None:
+        statement = select(models.Book)
+    else:
+        statement = select(*book_columns(fields, *pagination.BOOK_ORDERINGS[order]))
+    if genre is not None:
+        statement = statement.where(models.Book.genre == genre)
+    statement = _keyset_statement(statement, order, cursor).limit(limit + 1)
+    if fields is None:
+        books = (await db.scalars(statement)).all()
+    else:
+        books = (await db.execute(statement)).all()
+    next_cursor = None
+    if len(books) > limit:
+        books = books[:limit]
+        last = books[-1]
+        next_cursor = pagination.encode_cursor(
+            order, [getattr(last, column) for column in pagination.BOOK_ORDERINGS[order]]
+        )
+    return books, next_cursor
+
+async def stream_books(db: AsyncSession, order: str = "id", batch_size: int = 1000):
+    """Yield every book as a plain mapping, fetched through a server-side cursor in batches."""
+    columns = [getattr(models.Book, field) for field in schemas.field_names(schemas.Book)]
+    statement = _keyset_statement(select(*columns), order).execution_options(yield_per=batch_size)
+    result = await db.stream(statement)
+    async for row in result:
+        yield row._mapping
+
+async def get_book(db: AsyncSession, book_id: int):
+    return await db.get(models.Book, book_id)
+
+async def get_books_by_ids(db: AsyncSession, book_ids: list[int], fields):
+    """Rows of the given fields' columns for book_ids, in the order of book_ids; missing books are skipped."""
+    result = await db.execute(select(*book_columns(fields)).where(models.Book.id.in_(book_ids)))
+    rows = {row.id: row for row in result}
+    return [rows[book_id] for book_id in book_ids if book_id in rows]
+
+async def search_books(db: AsyncSession, q: str = None, title: str = None, author: str = None, genre: str = None,
+                       rating: float = None, skip: int = 0, limit: int = search.DEFAULT_LIMIT, fields=None):
+    return await search.search_books(db, q=q, title=title, author=author, genre=genre, rating=rating,
+                                     skip=skip, limit=limit,
+                                     columns=None if fields is None else book_columns(fields))
+
+async def create_book(db: AsyncSession, book: schemas.BookCreate):
     db_book = models.Book(
         title=book.title,
         author=book.author,
@@ -32,85 +97,254 @@ def create_book(db: Session, book: schemas.BookCreate):
         description=book.description
     )
     db.add(db_book)
-    db.commit()
-    db.refresh(db_book)
+    await facets.books_changed(db, after=[db_book])
+    await ranking.books_changed(db, after=[db_book])
+    await db.flush()
+    await recommend.books_changed(db, [db_book.id])
+    await db.commit()
+    await db.refresh(db_book)
+    search.index_book(db, db_book)
+    await response_cache.invalidate(
+        BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_SEARCH_TAG, BOOK_RANKINGS_TAG
+    )
     return db_book
 
-def update_book(db: Session, book_id: int, book: schemas.BookUpdate):
-    db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
-    print(book)
+async def create_books(db: AsyncSession, books: list[schemas.BookCreate]):
+    db_books = [
+        models.Book(
+            title=book.title,
+            author=book.author,
+            genre=book.genre,
+            rating=book.rating,
+            image_url=book.image_url,
+            description=book.description
+        )
+        for book in books
+    ]
+    # One transaction; the flush sends a single multi-row INSERT ... RETURNING
+    db.add_all(db_books)
+    await facets.books_changed(db, after=db_books)
+    await ranking.books_changed(db, after=db_books)
+    await db.flush()
+    await recommend.books_changed(db, [db_book.id for db_book in db_books])
+    await db.commit()
+    # Like create_book's refresh, but in one query: values come back as the database stores them
+    await db.scalars(
+        select(models.Book)
+        .where(models.Book.id.in_([db_book.id for db_book in db_books]))
+        .execution_options(populate_existing=True)
+    )
+    for db_book in db_books:
+        search.index_book(db, db_book)
+    await response_cache.invalidate(
+        BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_SEARCH_TAG, BOOK_RANKINGS_TAG
+    )
+    return db_books
+
+async def update_book(db: AsyncSession, book_id: int, book: schemas.BookUpdate):
+    db_book = await db.get(models.Book, book_id)
     if db_book:
+        rating_changed = db_book.rating != book.rating
+        before = [(db_book.genre, db_book.rating)]
+        before_names = [(db_book.genre, db_book.author)]
+        text_changed = (db_book.title, db_book.author, db_book.genre, db_book.description) != (
+            book.title, book.author, book.genre, book.description)
         db_book.title = book.title
         db_book.author = book.author
         db_book.genre = book.genre
         db_book.rating = book.rating
         db_book.image_url = book.image_url
         db_book.description = book.description
-        db.commit()
-        db.refresh(db_book)
+        await facets.books_changed(db, before=before_names, after=[db_book])
+        await ranking.books_changed(db, before=before, after=[db_book])
+        if text_changed:
+            await recommend.books_changed(db, [book_id])
+        await db.commit()
+        await db.refresh(db_book)
+        search.index_book(db, db_book)
+        tags = [book_tag(book_id), BOOK_SEARCH_TAG, BOOK_RANKINGS_TAG]
+        if rating_changed:
+            tags.append(BOOK_PAGES_BY_RATING_TAG)
+        await response_cache.invalidate(*tags)
     return db_book
 
-def delete_book(db: Session, book_id: int):
-    db_book = db.query(models.Book).filter(models.Book.id == book_id).first()
+async def delete_book(db: AsyncSession, book_id: int):
+    db_book = await db.get(models.Book, book_id)
     if db_book:
-        db.delete(db_book)
-        db.commit()
+        await db.delete(db_book)
+        await facets.books_changed(db, before=[(db_book.genre, db_book.author)])
+        await ranking.books_changed(db, before=[(db_book.genre, db_book.rating)])
+        await recommend.books_changed(db, [book_id])
+        await db.commit()
+        search.unindex_book(db, book_id)
+        await response_cache.invalidate(book_tag(book_id), BOOK_LISTS_TAG, BOOK_SEARCH_TAG, BOOK_RANKINGS_TAG)
     return db_book
 
-def get_users(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.User).offset(skip).limit(limit).all()
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 10):
+    result = await db.scalars(select(models.User).offset(skip).limit(limit))
+    return result.all()
+
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.scalars(select(models.User).where(models.User.username == username))
+    return result.first()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
-    if not pwd_context.verify(password, user.hashed_password):
+    valid, new_hash = await hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        # The stored hash predates the current work factor; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await hasher.hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_user(db: AsyncSession, user_id: int, user: schemas.UserUpdate):
+    db_user = await db.get(models.User, user_id)
     if db_user:
+        previous_username = db_user.username
         db_user.username = user.username
         db_user.email = user.email
         if user.password:
-            db_user.hashed_password = pwd_context.hash(user.password)
-        db.commit()
-        db.refresh(db_user)
+            db_user.hashed_password = await hasher.hash(user.password)
+        await db.commit()
+        await db.refresh(db_user)
+        principal_cache.invalidate(previous_username)
     return db_user
 
-def delete_user(db: Session, user_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+async def delete_user(db: AsyncSession, user_id: int):
+    db_user = await db.get(models.User, user_id)
     if db_user:
-        db.delete(db_user)
-        db.commit()
+        await db.delete(db_user)
+        await db.commit()
+        principal_cache.invalidate(db_user.username)
     return db_user
 
-def add_book_to_user(db: Session, user_id: int, book_id: int):
+async def _get_user_book(db: AsyncSession, user_id: int, book_id: int):
+    result = await db.scalars(
+        select(models.UserBook)
+        .where(models.UserBook.user_id == user_id, models.UserBook.book_id == book_id)
+    )
+    return result.first()
+
+async def add_book_to_user(db: AsyncSession, user_id: int, book_id: int):
     user_book = models.UserBook(user_id=user_id, book_id=book_id)
     db.add(user_book)
-    db.commit()
-    db.refresh(user_book)
+    try:
+        await db.flush()
+    except IntegrityError:
+        # Already on the list (unique user_id, book_id); adding again is a no-op
+        await db.rollback()
+        return await _get_user_book(db, user_id, book_id)
+    await ranking.saves_changed(db, [book_id], 1)
+    await recommend.books_changed(db, [book_id])
+    await db.commit()
+    await db.refresh(user_book)
+    await response_cache.invalidate(BOOK_RANKINGS_TAG)
     return user_book
 
-def remove_book_from_user(db: Session, user_id: int, book_id: int):
-    user_book = db.query(models.UserBook).filter(models.UserBook.user_id == user_id, models.UserBook.book_id == book_id).first()
+async def check_book_in_user_list(db: AsyncSession, user_id: int, book_id: int):
+    result = await db.execute(
+        select(models.UserBook.id)
+        .where(models.UserBook.user_id == user_id, models.UserBook.book_id == book_id)
+        .limit(1)
+    )
+    return result.first() is not None
+
+async def get_user_book_ids(db: AsyncSession, user_id: int, book_ids: list[int] = None):
+    """Ids of the books on a user's list, optionally restricted to book_ids, in one query."""
+    statement = select(models.UserBook.book_id).where(models.UserBook.user_id == user_id)
+    if book_ids is not None:
+        statement = statement.where(models.UserBook.book_id.in_(book_ids))
+    result = await db.scalars(statement.order_by(models.UserBook.book_id))
+    return result.all()
+
+async def remove_book_from_user(db: AsyncSession, user_id: int, book_id: int):
+    user_book = await _get_user_book(db, user_id, book_id)
     if user_book:
-        db.delete(user_book)
-        db.commit()
-    return user_book
\ No newline at end of file
+        await db.delete(user_book)
+        await ranking.saves_changed(db, [book_id], -1)
+        await recommend.books_changed(db, [book_id])
+        await db.commit()
+        await response_cache.invalidate(BOOK_RANKINGS_TAG)
+    return user_book
+
+def _insert_ignoring_duplicates(db: AsyncSession, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=["user_id", "book_id"])
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=["user_id", "book_id"])
+    return insert(table)
+
+async def update_user_books(db: AsyncSession, user_id: int, add: list[int] = (), remove: list[int] = ()):
+    """Add and remove many books from a user's list in one transaction.
+
+    Returns per-book results, or None if the user does not exist. Adds are
+    applied before removes, and repeating a batch changes nothing.
+    """
+    if await db.get(models.User, user_id) is None:
+        return None
+    add = list(dict.fromkeys(add))
+    remove = list(dict.fromkeys(remove))
+    book_ids = set(add) | set(remove)
+    existing_books = set(await db.scalars(select(models.Book.id).where(models.Book.id.in_(book_ids))))
+    on_list = set(await db.scalars(
+        select(models.UserBook.book_id)
+        .where(models.UserBook.user_id == user_id, models.UserBook.book_id.in_(book_ids))
+    ))
+
+    to_add = [book_id for book_id in add if book_id in existing_books and book_id not in on_list]
+    added = set()
+    if to_add:
+        # RETURNING reports the rows actually inserted, even if a concurrent request won a race
+        added = set(await db.scalars(
+            _insert_ignoring_duplicates(db, models.UserBook.__table__)
+            .values([{"user_id": user_id, "book_id": book_id} for book_id in to_add])
+            .returning(models.UserBook.book_id)
+        ))
+        on_list.update(added)
+    to_remove = [book_id for book_id in remove if book_id in on_list]
+    removed = set()
+    if to_remove:
+        removed = set(await db.scalars(
+            delete(models.UserBook)
+            .where(models.UserBook.user_id == user_id, models.UserBook.book_id.in_(to_remove))
+            .returning(models.UserBook.book_id)
+        ))
+    # A book both added and removed in this batch ends up where it started
+    await ranking.saves_changed(db, added - removed, 1)
+    await ranking.saves_changed(db, removed - added, -1)
+    await recommend.books_changed(db, added ^ removed)
+    await db.commit()
+    if added or removed:
+        await response_cache.invalidate(BOOK_RANKINGS_TAG)
+
+    results = []
+    for book_id in add:
+        if book_id not in existing_books:
+            status = "book_not_found"
+        else:
+            status = "added" if book_id in added else "already_present"
+        results.append(schemas.UserBookBatchItem(book_id=book_id, action="add", status=status))
+    for book_id in remove:
+        status = "removed" if book_id in removed else "not_present"
+        results.append(schemas.UserBookBatchItem(book_id=book_id, action="remove", status=status))
+    return schemas.UserBookBatchResult(user_id=user_id, results=results)
@@ -1,14 +1,185 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import asyncio
+import logging
 import os
+import threading
+import time
 
+logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"sslmode": "require"})
+# Connection pool tuning, overridable per deployment
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics:
+    """Counters describing how the connection pool is being used."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self, pool):
+        with self._lock:
+            data = {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "timeouts": self.timeouts,
+            }
+        if isinstance(pool, QueuePool):
+            data.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPoolMixin:
+    """Records how often and how long callers wait for a free pooled connection."""
+
+    def _do_get(self):
+        # Same condition QueuePool uses to decide whether it must block on the queue
+        would_wait = self._pool.empty() and -1 < self._max_overflow <= self._overflow
+        if not would_wait:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.increment("timeouts")
+            raise
+        finally:
+            pool_metrics.increment("waits")
+            pool_metrics.increment("wait_seconds", time.perf_counter() - start)
+
+
+class MeteredAsyncQueuePool(MeteredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _async_url(url):
+    """Map a sync database URL onto its async driver: asyncpg for Postgres, aiosqlite for SQLite."""
+    scheme, _, rest = url.partition("://")
+    driver = scheme.split("+")[0]
+    if driver in ("postgres", "postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    if driver == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+def _pool_options(poolclass):
+    return dict(
+        poolclass=poolclass,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+    )
+
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+# Deployed databases are managed by the Alembic migrations; a local SQLite file is created on startup
+CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "true" if IS_SQLITE else "false").lower() in ("1", "true", "yes")
+# Connections opened in the background at startup, so the first requests skip the connect and TLS handshake
+POOL_WARM_CONNECTIONS = int(os.getenv("DB_POOL_WARM_CONNECTIONS", str(min(POOL_SIZE, 2))))
+# SSL is only meaningful for the hosted Postgres; reusing pooled connections saves the TLS handshake
+REQUIRE_SSL = SQLALCHEMY_DATABASE_URL.startswith("postgres")
+
+# The sync engine is for command-line tools (the importer, aggregate and similarity index builds);
+# web processes, background tasks included, only use async_engine
+if IS_SQLITE:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(_async_url(SQLALCHEMY_DATABASE_URL))
+else:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"sslmode": "require"} if REQUIRE_SSL else {},
+        **_pool_options(QueuePool),
+    )
+    async_engine = create_async_engine(
+        _async_url(SQLALCHEMY_DATABASE_URL),
+        connect_args={"ssl": "require"} if REQUIRE_SSL else {},
+        **_pool_options(MeteredAsyncQueuePool),
+    )
+
+event.listen(async_engine.sync_engine, "connect", lambda *args: pool_metrics.increment("connects"))
+event.listen(async_engine.sync_engine, "checkout", lambda *args: pool_metrics.increment("checkouts"))
+event.listen(async_engine.sync_engine, "checkin", lambda *args: pool_metrics.increment("checkins"))
+event.listen(async_engine.sync_engine, "invalidate", lambda *args: pool_metrics.increment("invalidations"))
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay loaded after commit so routes can serialize them without lazy loads
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
+async def increment_counts(db, table, key_columns, rows, count_column="book_count"):
+    """Add each row's count_column value to the matching row of table, creating it if missing.
+
+    Used for counter tables that are maintained incrementally alongside writes.
+    """
+    rows = [row for row in rows if row[count_column]]
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={count_column: table.c[count_column] + statement.excluded[count_column]},
+        )
+        await db.execute(statement, rows)
+        return
+    for row in rows:
+        result = await db.execute(
+            update(table)
+            .where(*(table.c[column] == row[column] for column in key_columns))
+            .values({count_column: table.c[count_column] + row[count_column]})
+        )
+        if result.rowcount == 0:
+            await db.execute(insert(table).values(**row))
+
+
+async def warm_pool(count=POOL_WARM_CONNECTIONS):
+    """Open count connections at once and return them to the pool."""
+    connections = [async_engine.connect() for _ in range(count)]
+    try:
+        await asyncio.gather(*(connection.start() for connection in connections))
+    except Exception as exc:
+        # Requests will connect on demand; a failed warm-up must not take the worker down
+        logger.warning("Connection pool warm-up failed: %s", exc)
+    finally:
+        await asyncio.gather(*(connection.close() for connection in connections), return_exceptions=True)
+
 
+# Dependency: one session per request, shared by authentication and the route
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,250 @@
+import os
+from collections import Counter
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, search
+from .database import increment_counts
+
+DEFAULT_FACET_LIMIT = 20
+MAX_FACET_LIMIT = 100
+# Text searches count facets over at most this many matching books
+FACET_SCAN_LIMIT = int(os.getenv("FACET_SCAN_LIMIT", "10000"))
+
+
+def normalize_name(name):
+    name = name.strip() if name else ""
+    return name or None
+
+
+async def _resolve_ids(db: AsyncSession, model, names):
+    """Map names to ids of model (Genre or Author), creating missing rows."""
+    names = {name for name in names if name is not None}
+    if not names:
+        return {}
+    ids = dict((await db.execute(select(model.name, model.id).where(model.name.in_(names)))).all())
+    missing = [{"name": name, "book_count": 0} for name in names if name not in ids]
+    if missing:
+        dialect = db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            # A concurrent writer may create the same name; the unique constraint settles it
+            statement = dialect_insert(model.__table__).on_conflict_do_nothing(index_elements=["name"])
+        else:
+            statement = insert(model.__table__)
+        await db.execute(statement, missing)
+        ids.update((await db.execute(
+            select(model.name, model.id).where(model.name.in_([row["name"] for row in missing]))
+        )).all())
+    return ids
+
+
+async def books_changed(db: AsyncSession, before=(), after=()):
+    """Keep author/genre ids and the facet counters in step with book writes.
+
+    before holds the (genre, author) of books as they were, after the ORM
+    objects as they will be; creates pass only after, deletes only before.
+    Runs inside the caller's transaction, before its commit.
+    """
+    before = [(normalize_name(genre), normalize_name(author)) for genre, author in before]
+    after_names = [(normalize_name(book.genre), normalize_name(book.author)) for book in after]
+    genre_ids = await _resolve_ids(db, models.Genre, [genre for genre, _ in before + after_names])
+    author_ids = await _resolve_ids(db, models.Author, [author for _, author in before + after_names])
+
+    for book, (genre, author) in zip(after, after_names):
+        book.genre_id = genre_ids.get(genre)
+        book.author_id = author_ids.get(author)
+
+    genre_counts, author_counts, pair_counts = Counter(), Counter(), Counter()
+    for names, delta in [(names, -1) for names in before] + [(names, 1) for names in after_names]:
+        genre_id, author_id = genre_ids.get(names[0]), author_ids.get(names[1])
+        if genre_id is not None:
+            genre_counts[genre_id] += delta
+        if author_id is not None:
+            author_counts[author_id] += delta
+        if genre_id is not None and author_id is not None:
+            pair_counts[(genre_id, author_id)] += delta
+
+    for model, counts in ((models.Genre, genre_counts), (models.Author, author_counts)):
+        rows = [{"row_id": row_id, "delta": delta} for row_id, delta in counts.items() if delta]
+        if rows:
+            table = model.__table__
+            await db.execute(
+                update(table).where(table.c.id == bindparam("row_id"))
+                .values(book_count=table.c.book_count + bindparam("delta")),
+                rows,
+            )
+    await increment_counts(
+        db, models.GenreAuthorCount.__table__, ["genre_id", "author_id"],
+        [{"genre_id": genre_id, "author_id": author_id, "book_count": count}
+         for (genre_id, author_id), count in pair_counts.items()],
+    )
+
+
+async def _named_counts(db: AsyncSession, model, counts, limit):
+    """Top limit entries of {id: count} as FacetCount mappings, largest first."""
+    top = sorted((-count, row_id) for row_id, count in counts.items() if count > 0)[:limit]
+    return await _with_names(db, model, [(row_id, -count) for count, row_id in top])
+
+
+async def _with_names(db: AsyncSession, model, counts):
+    if not counts:
+        return []
+    names = dict((await db.execute(
+        select(model.id, model.name).where(model.id.in_([row_id for row_id, _ in counts]))
+    )).all())
+    return [{"id": row_id, "name": names[row_id], "count": count} for row_id, count in counts]
+
+
+async def _matching_ids(db: AsyncSession, model, value):
+    """Ids of the genres or authors matched by a search filter; None when there is no filter."""
+    if not value:
+        return None
+    # Same substring semantics as the search filter on books
+    return list(await db.scalars(select(model.id).where(model.name.ilike(f"%{value}%"))))
+
+
+async def _table_facets(db: AsyncSession, model, ids, limit):
+    """Top genres or authors by their stored book_count."""
+    statement = select(model.id, model.name, model.book_count).where(model.book_count > 0)
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    rows = await db.execute(statement.order_by(model.book_count.desc(), model.id).limit(limit))
+    return [{"id": row.id, "name": row.name, "count": row.book_count} for row in rows]
+
+
+async def _table_total(db: AsyncSession, model, ids):
+    statement = select(func.coalesce(func.sum(model.book_count), 0))
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    return (await db.execute(statement)).scalar_one()
+
+
+async def _pair_facets(db: AsyncSession, model, group_column, filter_column, filter_ids, group_ids, limit):
+    """Top genres (or authors) among the books of the selected authors (or genres)."""
+    pairs = models.GenreAuthorCount
+    if len(filter_ids) == 1 and group_ids is None:
+        # A single selected value: its pair rows already hold the final counts, read off the index in order
+        statement = (
+            select(group_column, pairs.book_count.label("count"))
+            .where(filter_column == filter_ids[0], pairs.book_count > 0)
+            .order_by(pairs.book_count.desc(), group_column)
+        )
+    else:
+        count = func.sum(pairs.book_count)
+        statement = select(group_column, count.label("count")).where(filter_column.in_(filter_ids))
+        if group_ids is not None:
+            statement = statement.where(group_column.in_(group_ids))
+        statement = statement.group_by(group_column).having(count > 0).order_by(count.desc(), group_column)
+    rows = (await db.execute(statement.limit(limit))).all()
+    return await _with_names(db, model, [(row[0], row[1]) for row in rows])
+
+
+async def _counts_from_tables(db: AsyncSession, author, genre, limit):
+    """Facet counts for author/genre filters only, read from the counter tables."""
+    pairs = models.GenreAuthorCount
+    genre_ids = await _matching_ids(db, models.Genre, genre)
+    author_ids = await _matching_ids(db, models.Author, author)
+    if genre_ids == [] or author_ids == []:
+        return 0, [], []
+
+    if author_ids is None:
+        genre_facets = await _table_facets(db, models.Genre, genre_ids, limit)
+        if genre_ids is None:
+            # Books without a genre are in no counter, so the unfiltered total counts books
+            total = (await db.execute(select(func.count(models.Book.id)))).scalar_one()
+        else:
+            total = await _table_total(db, models.Genre, genre_ids)
+    else:
+        genre_facets = await _pair_facets(db, models.Genre, pairs.genre_id, pairs.author_id,
+                                          author_ids, genre_ids, limit)
+    if genre_ids is None:
+        author_facets = await _table_facets(db, models.Author, author_ids, limit)
+        if author_ids is not None:
+            total = await _table_total(db, models.Author, author_ids)
+    else:
+        author_facets = await _pair_facets(db, models.Author, pairs.author_id, pairs.genre_id,
+                                           genre_ids, author_ids, limit)
+    if genre_ids is not None and author_ids is not None:
+        total = (await db.execute(
+            select(func.coalesce(func.sum(pairs.book_count), 0))
+            .where(pairs.genre_id.in_(genre_ids), pairs.author_id.in_(author_ids))
+        )).scalar_one()
+    return total, genre_facets, author_facets
+
+
+async def facet_counts(db: AsyncSession, q: str = None, title: str = None, author: str = None, genre: str = None,
+                       rating: float = None, limit: int = DEFAULT_FACET_LIMIT):
+    """Genre and author counts over the books matching a search, as a schemas.Facets mapping.
+
+    Without a text query, title or rating, counts are read from the counter
+    tables and never scan books. Otherwise up to FACET_SCAN_LIMIT matching
+    books are aggregated.
+    """
+    limit = max(1, min(limit, MAX_FACET_LIMIT))
+    if not (search.tokenize(q) or title or rating):
+        total, genre_facets, author_facets = await _counts_from_tables(db, author, genre, limit)
+        return {"total": total, "exact": True, "genres": genre_facets, "authors": author_facets}
+
+    statement = await search.matching_statement(
+        db, [models.Book.genre_id, models.Book.author_id], q=q, title=title, author=author, genre=genre,
+        rating=rating, limit=FACET_SCAN_LIMIT + 1,
+    )
+    rows = (await db.execute(statement)).all()
+    exact = len(rows) <= FACET_SCAN_LIMIT
+    rows = rows[:FACET_SCAN_LIMIT]
+    genre_counts = Counter(row.genre_id for row in rows if row.genre_id is not None)
+    author_counts = Counter(row.author_id for row in rows if row.author_id is not None)
+    return {
+        "total": len(rows),
+        "exact": exact,
+        "genres": await _named_counts(db, models.Genre, genre_counts, limit),
+        "authors": await _named_counts(db, models.Author, author_counts, limit),
+    }
+
+
+def rebuild(connection):
+    """Recreate author/genre ids and every facet counter from the books table (sync)."""
+    books = models.Book.__table__
+    pairs = models.GenreAuthorCount.__table__
+    for model, column, id_column in ((models.Genre, books.c.genre, books.c.genre_id),
+                                     (models.Author, books.c.author, books.c.author_id)):
+        table = model.__table__
+        name = func.trim(column)
+        connection.execute(
+            insert(table).from_select(
+                ["name", "book_count"],
+                select(name, 0).where(column.isnot(None), name != "", name.not_in(select(table.c.name)))
+                .group_by(name),
+            )
+        )
+        connection.execute(
+            update(books).values({
+                id_column: select(table.c.id).where(table.c.name == func.trim(column)).scalar_subquery(),
+                # Derived ids do not change a book's representation; keep its validators
+                books.c.updated_at: books.c.updated_at,
+            })
+        )
+        connection.execute(
+            update(table).values(
+                book_count=select(func.count()).select_from(books).where(id_column == table.c.id).scalar_subquery()
+            )
+        )
+    connection.execute(delete(pairs))
+    connection.execute(
+        insert(pairs).from_select(
+            ["genre_id", "author_id", "book_count"],
+            select(books.c.genre_id, books.c.author_id, func.count())
+            .where(books.c.genre_id.isnot(None), books.c.author_id.isnot(None))
+            .group_by(books.c.genre_id, books.c.author_id),
+        )
+    )
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    with engine.begin() as connection:
+        rebuild(connection)
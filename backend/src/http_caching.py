@@ -0,0 +1,62 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Browsers may keep API responses but must revalidate them; a matching ETag costs a 304 without a body
+API_CACHE_CONTROL = os.getenv("API_CACHE_CONTROL", "public, no-cache")
+
+
+def book_etag(book):
+    return f'W/"b{book.id}.v{book.version}"'
+
+
+def body_etag(body: bytes):
+    return f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+
+def http_date(value: datetime):
+    if value.tzinfo is None:
+        # SQLite hands back naive timestamps; they are stored in UTC
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def last_modified_of(books):
+    timestamps = [book.updated_at for book in books if book.updated_at is not None]
+    return http_date(max(timestamps)) if timestamps else None
+
+
+def _etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as required for GET
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def _not_modified_since(header, last_modified):
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional_response(request: Request, body: bytes, etag: str, last_modified: str = None,
+                         media_type="application/json"):
+    """Return a 304 when the client's validators still match, otherwise the full body."""
+    headers = {"ETag": etag, "Cache-Control": API_CACHE_CONTROL}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    # If-Modified-Since is only consulted when the client sent no ETag
+    if (if_none_match and _etag_matches(if_none_match, etag)) or (
+        not if_none_match and if_modified_since and last_modified
+        and _not_modified_since(if_modified_since, last_modified)
+    ):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
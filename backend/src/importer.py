@@ -0,0 +1,254 @@
+"""Bulk import of books from a CSV file.
+
+The file is read in chunks, each chunk is validated against schemas.BookCreate
+in a single call and upserted on id: Postgres goes through COPY into a
+temporary table followed by INSERT ... ON CONFLICT, other databases through
+executemany batches. Memory use depends on the chunk size, not the file size.
+
+    alembic -c backend/alembic.ini upgrade head
+    python -m backend.src.importer backend/data/mock.csv --batch-size 5000
+
+The schema is owned by the migrations, so run them before the first import.
+
+The CSV uses the columns of backend/data/mock.csv
+(id,title,author,genre,rating,image_url); a description column is optional.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import itertools
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import facets, models, ranking, schemas
+from .cache import (
+    BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_RANKINGS_TAG, BOOK_SEARCH_TAG, book_tag,
+    response_cache,
+)
+
+DEFAULT_BATCH_SIZE = 5000
+COLUMNS = ["id", "title", "author", "genre", "rating", "image_url", "description"]
+
+try:
+    from pydantic import TypeAdapter
+
+    _batch_validator = TypeAdapter(list[schemas.BookCreate]).validate_python
+except ImportError:  # pydantic 1
+    from pydantic import parse_obj_as
+
+    def _batch_validator(rows):
+        return parse_obj_as(list[schemas.BookCreate], rows)
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    imported: int = 0
+    rejected: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return self.imported / self.seconds if self.seconds else 0.0
+
+
+def _chunks(reader, size):
+    while True:
+        chunk = list(itertools.islice(reader, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _normalize(row):
+    # Empty CSV cells mean "no value", not an empty string
+    return {name: (value.strip() or None) if isinstance(value, str) else value
+            for name, value in row.items() if name is not None}
+
+
+def validate_rows(rows, line_offset=2):
+    """Validate a chunk of CSV rows in one pass.
+
+    Returns the valid rows as dicts ready for insertion, and a list of
+    (line number, message) for rejected ones. line_offset is the file line of
+    rows[0], so that errors point at the CSV.
+    """
+    rows = [_normalize(row) for row in rows]
+    errors = {}
+    for index, row in enumerate(rows):
+        try:
+            row["id"] = int(row["id"])
+            if row["id"] < 1:
+                raise ValueError
+        except (KeyError, TypeError, ValueError):
+            errors[index] = "id: a positive integer is required"
+    candidates = [index for index in range(len(rows)) if index not in errors]
+    while candidates:
+        try:
+            books = _batch_validator([rows[index] for index in candidates])
+            break
+        except ValidationError as error:
+            # Errors are located by position in the batch; drop those rows and validate the rest again
+            failed = {}
+            for detail in error.errors():
+                # pydantic 1 nests list items under __root__
+                loc = [part for part in detail["loc"] if part != "__root__"]
+                failed.setdefault(candidates[loc[0]], f"{'.'.join(map(str, loc[1:]))}: {detail['msg']}")
+            errors.update(failed)
+            candidates = [index for index in candidates if index not in failed]
+    else:
+        books = []
+    valid = []
+    for index, book in zip(candidates, books):
+        values = dict(book.dict() if not hasattr(book, "model_dump") else book.model_dump(), id=rows[index]["id"])
+        valid.append(values)
+    rejected = [(line_offset + index, message) for index, message in sorted(errors.items())]
+    return valid, rejected
+
+
+def _upsert_copy(connection, rows, update_columns):
+    """Postgres: COPY the chunk into a temporary table and merge it into books."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if row[name] is None else row[name] for name in COLUMNS])
+    buffer.seek(0)
+    columns = ", ".join(COLUMNS)
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in update_columns)
+    connection.exec_driver_sql(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS books_import "
+        "(id integer, title varchar, author varchar, genre varchar, rating float, "
+        "image_url varchar, description varchar) ON COMMIT DELETE ROWS"
+    )
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY books_import ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    connection.exec_driver_sql(
+        f"INSERT INTO books ({columns}, version, updated_at) "
+        f"SELECT DISTINCT ON (id) {columns}, 1, now() FROM books_import ORDER BY id "
+        f"ON CONFLICT (id) DO UPDATE SET {updates}, "
+        "version = books.version + 1, updated_at = EXCLUDED.updated_at"
+    )
+
+
+def _upsert_executemany(connection, rows, update_columns):
+    table = models.Book.__table__
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            **{name: statement.excluded[name] for name in update_columns},
+            "version": table.c.version + 1,
+            "updated_at": datetime.now(timezone.utc),
+        },
+    )
+    connection.execute(statement, rows)
+
+
+def _reset_id_sequence(connection):
+    # Explicit ids bypass the serial sequence; move it past them so new books do not collide
+    connection.exec_driver_sql(
+        "SELECT setval(pg_get_serial_sequence('books', 'id'), coalesce(max(id), 1)) FROM books"
+    )
+
+
+def import_books(engine, csv_file, batch_size=DEFAULT_BATCH_SIZE, progress=None, on_import=None):
+    """Stream csv_file (a path or text file object) into the books table.
+
+    Each chunk is committed on its own, so an interrupted import can simply be
+    re-run: rows are upserted on id. Columns missing from the file keep their
+    stored values for existing books. progress, if given, is called with the
+    running ImportStats after every chunk, and on_import with the ids of the
+    books each committed chunk inserted or updated.
+    """
+    if isinstance(csv_file, str):
+        with open(csv_file, newline="", encoding="utf-8") as file:
+            return import_books(engine, file, batch_size, progress, on_import)
+
+    stats = ImportStats()
+    use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+    upsert = _upsert_copy if use_copy else _upsert_executemany
+    started = time.perf_counter()
+    reader = csv.DictReader(csv_file)
+    update_columns = [name for name in COLUMNS[1:] if name in (reader.fieldnames or ())]
+    for chunk in _chunks(reader, batch_size):
+        valid, rejected = validate_rows(chunk, line_offset=stats.read + 2)
+        stats.read += len(chunk)
+        stats.rejected += len(rejected)
+        # Keep a bounded sample so that a bad file cannot grow memory
+        stats.errors.extend(rejected[:max(0, 100 - len(stats.errors))])
+        if valid:
+            with engine.begin() as connection:
+                upsert(connection, valid, update_columns)
+                # Logged like any other book write, for the similar-books indexes to pick up
+                connection.execute(insert(models.SimilarityChange.__table__),
+                                   [{"book_id": row["id"]} for row in valid])
+            stats.imported += len(valid)
+            if on_import:
+                on_import([row["id"] for row in valid])
+        stats.seconds = time.perf_counter() - started
+        if progress:
+            progress(stats)
+
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            _reset_id_sequence(connection)
+        # Upserts bypass the incremental facet and ranking updates; one pass over the table is cheaper anyway
+        facets.rebuild(connection)
+        ranking.rebuild(connection)
+        if engine.dialect.name == "postgresql":
+            connection.exec_driver_sql("ANALYZE books")
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import books from a CSV file.")
+    parser.add_argument("csv_file")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    def report(stats):
+        print(f"{stats.read:>10} rows read  {stats.imported:>10} imported  "
+              f"{stats.rejected:>6} rejected  {stats.rows_per_second:>9.0f} rows/s", file=sys.stderr)
+
+    # Invalidation only reaches a shared (Redis) cache; per-process caches expire within CACHE_TTL.
+    # One loop for the whole import, since the Redis client stays bound to the loop it first ran on.
+    loop = asyncio.new_event_loop()
+
+    def invalidate_books(book_ids):
+        # Detail pages and every cached list containing an updated book
+        loop.run_until_complete(response_cache.invalidate(*(book_tag(book_id) for book_id in book_ids)))
+
+    try:
+        stats = import_books(engine, args.csv_file, args.batch_size,
+                             progress=None if args.quiet else report, on_import=invalidate_books)
+        if stats.imported:
+            loop.run_until_complete(response_cache.invalidate(
+                BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_SEARCH_TAG, BOOK_RANKINGS_TAG
+            ))
+    finally:
+        loop.close()
+    for line, message in stats.errors:
+        print(f"line {line}: {message}", file=sys.stderr)
+    print(f"Imported {stats.imported} of {stats.read} rows ({stats.rejected} rejected) "
+          f"in {stats.seconds:.2f}s, {stats.rows_per_second:.0f} rows/s")
+    return 1 if stats.rejected and not stats.imported else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""Request latency, database query and profiling instrumentation.
+
+InstrumentationMiddleware times every request into per-route histograms and
+collects the queries it runs through SQLAlchemy cursor events (see
+instrument_engine). Requests that repeat the same SELECT at least
+N_PLUS_ONE_THRESHOLD times are logged and counted as likely N+1 patterns.
+Everything is exposed in the Prometheus text format by render_prometheus.
+Metrics are per process; with several workers each one reports its own.
+
+Setting PROFILE_DIR turns on profiling: a sample of requests runs under
+pyinstrument (or cProfile when it is not installed), and the reports of those
+slower than PROFILE_SLOW_MS are written to that directory.
+"""
+import asyncio
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrument is optional; cProfile is always available
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# A SELECT repeated this many times within one request is reported as a likely N+1 query
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+# Fraction of requests run under the profiler while profiling is on
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """Queries executed on behalf of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.query_seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated_selects(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return [(statement, count) for statement, count in self.statements.items()
+                if count >= threshold and statement.lstrip()[:6].upper() == "SELECT"]
+
+
+_request_stats: ContextVar = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums = Counter()
+        self.totals = Counter()
+
+    def observe(self, labels, value):
+        counts = self.counts[labels]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        self.sums[labels] += value
+        self.totals[labels] += 1
+
+    def samples(self, name, label_names):
+        for labels, counts in sorted(self.counts.items()):
+            pairs = list(zip(label_names, labels))
+            for bound, count in zip(self.buckets, counts):
+                yield f"{name}_bucket", pairs + [("le", _format_value(bound))], count
+            yield f"{name}_bucket", pairs + [("le", "+Inf")], self.totals[labels]
+            yield f"{name}_sum", pairs, self.sums[labels]
+            yield f"{name}_count", pairs, self.totals[labels]
+
+
+class RequestMetrics:
+    """Per-route request and query aggregates."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_seconds = Counter()
+        self.n_plus_one = Counter()
+        self.background_queries = 0
+        self.background_query_seconds = 0.0
+
+    def observe_request(self, method, route, status, seconds, stats):
+        with self._lock:
+            self.latency.observe((method, route, str(status)), seconds)
+            self.queries.observe((method, route), stats.queries)
+            self.query_seconds[(method, route)] += stats.query_seconds
+            self.n_plus_one[(method, route)] += len(stats.repeated_selects())
+
+    def observe_background_query(self, seconds):
+        # Queries outside any request, e.g. at startup or from background tasks
+        with self._lock:
+            self.background_queries += 1
+            self.background_query_seconds += seconds
+
+    def samples(self):
+        with self._lock:
+            yield ("litrank_http_request_duration_seconds", "histogram", "Request latency by route",
+                   list(self.latency.samples("litrank_http_request_duration_seconds", ("method", "route", "status"))))
+            yield ("litrank_db_queries_per_request", "histogram", "Database queries executed per request",
+                   list(self.queries.samples("litrank_db_queries_per_request", ("method", "route"))))
+            yield ("litrank_db_query_seconds_total", "counter", "Time spent in database queries by route",
+                   [("litrank_db_query_seconds_total", [("method", method), ("route", route)], value)
+                    for (method, route), value in sorted(self.query_seconds.items())])
+            yield ("litrank_db_n_plus_one_total", "counter", "Statements repeated at least "
+                   f"{N_PLUS_ONE_THRESHOLD} times within a request",
+                   [("litrank_db_n_plus_one_total", [("method", method), ("route", route)], value)
+                    for (method, route), value in sorted(self.n_plus_one.items())])
+            yield ("litrank_db_background_queries_total", "counter", "Database queries outside a request",
+                   [("litrank_db_background_queries_total", [], self.background_queries)])
+            yield ("litrank_db_background_query_seconds_total", "counter", "Time spent in queries outside a request",
+                   [("litrank_db_background_query_seconds_total", [], self.background_query_seconds)])
+
+
+request_metrics = RequestMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    stats = _request_stats.get()
+    if stats is None:
+        request_metrics.observe_background_query(seconds)
+    else:
+        stats.record(statement, seconds)
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument_engine(engine):
+    """Time every statement run by engine (a sync Engine; pass async_engine.sync_engine)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def route_name(scope, root_path=""):
+    """The route template a handled request matched, which keeps label cardinality bounded.
+
+    root_path is the scope's root_path before routing; mounted applications
+    (static files) extend it and are reported under their mount point.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("root_path", "") != root_path:
+        return scope["root_path"][len(root_path):] + "/*"
+    return "<unmatched>"
+
+
+class Profiler:
+    """Runs a sample of requests under a stack profiler and keeps the reports of slow ones.
+
+    Only one request is profiled at a time. cProfile profiles the whole thread,
+    so its reports of concurrent requests include the other requests' work;
+    pyinstrument attributes time to the awaiting request.
+    """
+
+    def __init__(self, directory, slow_ms=PROFILE_SLOW_MS, sample_rate=PROFILE_SAMPLE_RATE):
+        self.directory = directory
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.kind = "pyinstrument" if pyinstrument is not None else "cprofile"
+        self._busy = False
+        self._sequence = itertools.count(1)
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self._busy or random.random() >= self.sample_rate:
+            return None
+        self._busy = True
+        if pyinstrument is not None:
+            profile = pyinstrument.Profiler(async_mode="enabled")
+            profile.start()
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+        return profile
+
+    async def finish(self, profile, method, route, seconds):
+        try:
+            if pyinstrument is not None:
+                profile.stop()
+            else:
+                profile.disable()
+        finally:
+            self._busy = False
+        if seconds * 1000 < self.slow_ms:
+            return
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._sequence)}-{method}-{slug}-{seconds * 1000:.0f}ms"
+        # Rendering and writing a report takes a while; keep it off the event loop
+        path = await asyncio.to_thread(self._write, profile, os.path.join(self.directory, name))
+        logger.info("Profiled %s %s in %.0f ms: %s", method, route, seconds * 1000, path)
+
+    def _write(self, profile, path):
+        if pyinstrument is not None:
+            path += ".html"
+            report = profile.output_html()
+        else:
+            path += ".txt"
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(60)
+            report = output.getvalue()
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(report)
+        return path
+
+
+class InstrumentationMiddleware:
+    """Times requests and their queries, reports N+1 patterns and optionally profiles.
+
+    Adds a Server-Timing header with the database time and query count, so the
+    numbers for a single request are visible in the browser's network panel.
+    """
+
+    def __init__(self, app, metrics=request_metrics, profile_dir=PROFILE_DIR):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = Profiler(profile_dir) if profile_dir else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        root_path = scope.get("root_path", "")
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = (f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries", '
+                          f"app;dur={(time.perf_counter() - started) * 1000:.1f}")
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+            await send(message)
+
+        profile = self.profiler.start() if self.profiler else None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - started
+            _request_stats.reset(token)
+            method, route = scope["method"], route_name(scope, root_path)
+            self.metrics.observe_request(method, route, status, seconds, stats)
+            for statement, count in stats.repeated_selects():
+                logger.warning("Possible N+1 query in %s %s: executed %d times: %s",
+                               method, route, count, " ".join(statement.split())[:200])
+            if profile is not None:
+                await self.profiler.finish(profile, method, route, seconds)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6)) if value != int(value) else f"{value:.1f}"
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def snapshot_samples(prefix, snapshot, counters, labels=()):
+    """Metric families for the numeric entries of a metrics snapshot dict.
+
+    Names in counters become counters with a _total suffix, the rest gauges;
+    string entries (such as a backend name) are attached as labels.
+    """
+    labels = [*labels, *((name, value) for name, value in snapshot.items() if isinstance(value, str))]
+    for name, value in snapshot.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if name in counters:
+            metric = f"{prefix}_{name}_total"
+            yield metric, "counter", f"{prefix} {name}", [(metric, labels, value)]
+        else:
+            metric = f"{prefix}_{name}"
+            yield metric, "gauge", f"{prefix} {name}", [(metric, labels, value)]
+
+
+def render_prometheus(*families):
+    """Prometheus text exposition of metric families.
+
+    Each family is (name, type, help, samples) with samples as
+    (sample name, [(label, value)], value).
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample, labels, value in samples:
+            label_text = ",".join(f'{label}="{_escape(text)}"' for label, text in labels)
+            lines.append(f"{sample}{{{label_text}}} {_format_value(value)}" if labels
+                         else f"{sample} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
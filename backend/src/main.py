@@ -1,113 +1,163 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Optional
-from passlib.context import CryptContext
-from starlette.staticfiles import StaticFiles
-
-from .database import SessionLocal, engine
-from . import models, crud, schemas
-
-
-models.Base.metadata.create_all(bind=engine)
-
-
-
-app = FastAPI()
-
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+from typing import Literal, Optional
+import asyncio
+import json
+import os
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from .database import CREATE_SCHEMA, AsyncSessionLocal, async_engine, get_db, pool_metrics, warm_pool
+from .passwords import PasswordHasherBusy, hasher
+from .principals import principal_cache
+from .http_caching import body_etag, book_etag, conditional_response, last_modified_of
+from .assets import StaticAssets
+from .compression import CompressionMiddleware
+from .instrumentation import InstrumentationMiddleware, instrument_engine
+from .serialization import book_dicts, dumps
+from .cache import (
+    BOOK_LISTS_TAG, BOOK_PAGE_TAIL_TAG, BOOK_PAGES_BY_RATING_TAG, BOOK_RANKINGS_TAG, BOOK_SEARCH_TAG, book_tag, cached,
+    response_cache,
+)
+from . import models, crud, schemas, search, pagination, ranking, facets, instrumentation
+from .recommend import DEFAULT_K, MAX_K, RECOMMEND_REFRESH_SECONDS, IndexNotReady, maintain, similarity_index
+
+
+# Nothing touches the database at import time: with gunicorn's preload the module
+# is imported once in the master, and connections must not be shared across forks
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if CREATE_SCHEMA:
+        async with async_engine.begin() as connection:
+            await connection.run_sync(models.Base.metadata.create_all)
+    # Serve right away; the first requests find warm connections if they arrive late enough
+    warm_up = asyncio.create_task(warm_pool())
+    # The similar-books index is built offline; one process per machine applies logged changes to it
+    recommender = asyncio.create_task(maintain())
+    yield
+    warm_up.cancel()
+    recommender.cancel()
+    hasher.shutdown()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Built by `python -m backend.src.assets`; falls back to the plain frontend directory
+static_assets = StaticAssets()
+app.mount("/static", static_assets, name="static")
+
+# Shed load instead of queueing logins and sign-ups indefinitely behind bcrypt
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(IndexNotReady)
+async def similarity_index_not_ready_handler(request: Request, exc: IndexNotReady):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(RECOMMEND_REFRESH_SECONDS))},
+    )
 
 # JWT Configuration
 SECRET_KEY = "a_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Responses smaller than this are not worth compressing
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "500"))
+
+# Upper bound on the items accepted by a single batch request
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
 
 # OAuth2 schema
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Utility: Verify password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-# Utility: Hash password jj
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 # Utility: Get user from database
-def get_user(db, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user(db: AsyncSession, username: str):
+    return await crud.get_user_by_username(db, username)
 
-# Utility: Authenticate user
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
-        return False
-    return user
+# Utility: Authenticate user (bcrypt runs in the password hasher's worker pool)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    return await crud.authenticate_user(db, username, password)
 
 # Create a JWT token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": int(time.time())})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-# Dependency: Get current user from token
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    db = SessionLocal()
+# Tokens issued before a user was updated or deleted must not be trusted on their claims alone
+principal_cache.max_token_age = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+def credentials_exception():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid authentication credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+# Dependency: Decode and validate the token's claims
+def get_token_payload(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        user = get_user(db, username)
-        if user is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user
     except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    finally:
-        db.close()
+        raise credentials_exception()
+    if payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
+
+# Dependency: Get current user from token, served from the principal cache when possible
+async def get_current_user(payload: dict = Depends(get_token_payload), db: AsyncSession = Depends(get_db)):
+    username, issued_at = payload["sub"], payload.get("iat")
+    principal = principal_cache.get(username, issued_at)
+    if principal is not None:
+        return principal
+    user = await get_user(db, username)
+    if user is None:
+        raise credentials_exception()
+    principal = schemas.User(id=user.id, username=user.username, email=user.email)
+    principal_cache.set(username, issued_at, principal)
+    return principal
+
+# Dependency: Answer from the token's claims alone unless the user changed since it was issued
+async def get_token_principal(payload: dict = Depends(get_token_payload), db: AsyncSession = Depends(get_db)):
+    username, issued_at = payload["sub"], payload.get("iat")
+    if "id" in payload and "email" in payload and not principal_cache.is_stale(username, issued_at):
+        return schemas.User(id=payload["id"], username=username, email=payload["email"])
+    return await get_current_user(payload, db)
 
 # Login route: Token generation
 @app.post("/token")
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    db = SessionLocal()
-    try:
-        user = authenticate_user(db, form_data.username, form_data.password)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Incorrect username or password",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-        return {"access_token": access_token, "token_type": "bearer"}
-    finally:
-        db.close()
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user.username, "id": user.id, "email": user.email}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer"}
 
 # Protected route
 @app.get("/users/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(get_token_principal)):
     return current_user
 
 # Existing routes and middleware
@@ -117,136 +167,302 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+# Added last so it wraps everything else, compression included
+app.add_middleware(InstrumentationMiddleware)
+instrument_engine(async_engine.sync_engine)
+
+def check_batch_size(items):
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {MAX_BATCH_SIZE} items")
+
+# Utility: Serialize response content once so it can be cached as bytes
+def json_bytes(content):
+    return dumps(jsonable_encoder(content))
+
+# Book lists are encoded straight from rows; the schemas only document the shape
+BOOK_FIELDS = schemas.field_names(schemas.Book)
+BOOK_FIELD_PRESETS = {"summary": schemas.field_names(schemas.BookSummary)}
+
+# Dependency: Parse ?fields= into the book fields to return (id is always included)
+def book_fields(fields: Optional[str] = Query(
+    None, description='Comma-separated book fields to return, or "summary" for the fields of a book card'
+)):
+    if fields is None:
+        return BOOK_FIELDS
+    if fields in BOOK_FIELD_PRESETS:
+        return BOOK_FIELD_PRESETS[fields]
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BOOK_FIELDS]
+    if not names:
+        raise HTTPException(status_code=400, detail="No fields requested")
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(BOOK_FIELDS)} or summary",
+        )
+    return list(dict.fromkeys(["id", *names]))
+
+def book_list_json(books, fields=BOOK_FIELDS):
+    return dumps(book_dicts(books, fields))
+
+# Collections carry only an ETag: the newest updated_at among the items still
+# listed does not move when a book is deleted, so Last-Modified would go stale
+def list_validators(body: bytes):
+    return {"etag": body_etag(body)}
+
+def cached_json_response(request: Request, entry):
+    body, validators = entry
+    return conditional_response(request, body, validators["etag"], validators.get("last_modified"))
 
 @app.get("/books/", response_model=list[schemas.Book])
-def read_books(skip: int = 0, limit: int = 50):
-    db = SessionLocal()
+async def read_books(request: Request, skip: int = 0, limit: int = 50, fields: list[str] = Depends(book_fields),
+                     db: AsyncSession = Depends(get_db)):
+    async def produce():
+        books = await crud.get_books(db, skip=skip, limit=limit, fields=fields)
+        body = book_list_json(books, fields)
+        return body, [BOOK_LISTS_TAG] + [book_tag(book.id) for book in books], list_validators(body)
+    return cached_json_response(request, await cached(f"books:list:{skip}:{limit}:{','.join(fields)}", produce))
+
+@app.get("/books/page/", response_model=schemas.BookPage)
+async def read_books_page(request: Request, order: Literal["id", "rating"] = "id", cursor: Optional[str] = None,
+                          limit: int = Query(50, ge=1, le=200), fields: list[str] = Depends(book_fields),
+                          db: AsyncSession = Depends(get_db)):
+    async def produce():
+        books, next_cursor = await crud.get_books_page(db, order=order, cursor=cursor, limit=limit, fields=fields)
+        tags = [book_tag(book.id) for book in books]
+        if order == "rating":
+            tags.append(BOOK_PAGES_BY_RATING_TAG)
+        elif next_cursor is None:
+            tags.append(BOOK_PAGE_TAIL_TAG)
+        body = dumps({"items": book_dicts(books, fields), "next_cursor": next_cursor})
+        return body, tags, list_validators(body)
+    key = f"books:page:{order}:{cursor or ''}:{limit}:{','.join(fields)}"
     try:
-        books = crud.get_books(db, skip=skip, limit=limit)
-        return books
-    finally:
-        db.close()
+        return cached_json_response(request, await cached(key, produce))
+    except pagination.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+@app.get("/books/stream/")
+async def stream_books(order: Literal["id", "rating"] = "id"):
+    # The generator owns its session so it stays open until the last row is sent
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            async for row in crud.stream_books(db, order=order):
+                yield dumps(dict(row)) + b"\n"
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @app.get("/books/{book_id}", response_model=schemas.Book)
-def read_book(book_id: int):
-    db = SessionLocal()
-    try:
-        book = crud.get_book(db, book_id=book_id)
+async def read_book(request: Request, book_id: int, db: AsyncSession = Depends(get_db)):
+    async def produce():
+        book = await crud.get_book(db, book_id=book_id)
         if not book:
             raise HTTPException(status_code=404, detail="Book not found")
-        return book
-    finally:
-        db.close()
+        validators = {"etag": book_etag(book), "last_modified": last_modified_of([book])}
+        return dumps(book_dicts([book], BOOK_FIELDS)[0]), [book_tag(book_id)], validators
+    return cached_json_response(request, await cached(book_tag(book_id), produce))
         
+@app.get("/books/{book_id}/similar", response_model=list[schemas.SimilarBook])
+async def read_similar_books(request: Request, book_id: int, k: int = Query(DEFAULT_K, ge=1, le=MAX_K),
+                             db: AsyncSession = Depends(get_db)):
+    async def produce():
+        similar = await asyncio.to_thread(similarity_index.similar, book_id, k)
+        if similar is None:
+            if not await crud.get_book(db, book_id=book_id):
+                raise HTTPException(status_code=404, detail="Book not found")
+            # Created since the last refresh
+            similar = []
+        scores = dict(similar)
+        books = await crud.get_books_by_ids(db, list(scores), BOOK_FIELD_PRESETS["summary"])
+        items = book_dicts(books, BOOK_FIELD_PRESETS["summary"])
+        for item in items:
+            item["score"] = scores[item["id"]]
+        body = dumps(items)
+        return body, [book_tag(book_id)] + [book_tag(book.id) for book in books], list_validators(body)
+    # Scores move as the index refreshes, so entries expire with it rather than on tags alone
+    key = f"books:similar:{book_id}:{k}"
+    return cached_json_response(request, await cached(key, produce, ttl=RECOMMEND_REFRESH_SECONDS))
+
 @app.put("/books/{book_id}", response_model=schemas.Book)
-def update_book(book_id: int, book: schemas.BookUpdate):
-    db = SessionLocal()
-    try:
-        db_book = crud.update_book(db, book_id=book_id, book=book)
-        if not db_book:
-            raise HTTPException(status_code=404, detail="Book not found")
-        return db_book
-    finally:
-        db.close()
+async def update_book(book_id: int, book: schemas.BookUpdate, db: AsyncSession = Depends(get_db)):
+    db_book = await crud.update_book(db, book_id=book_id, book=book)
+    if not db_book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return db_book
 
 @app.delete("/books/{book_id}", response_model=schemas.Book)
-def delete_book(book_id: int):
-    db = SessionLocal()
-    try:
-        book = crud.get_book(db, book_id=book_id)
-        if not book:
-            raise HTTPException(status_code=404, detail="Book not found")
-        db_book = crud.delete_book(db, book_id=book_id)
-        return db_book
-    finally:
-        db.close()
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_db)):
+    book = await crud.get_book(db, book_id=book_id)
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    db_book = await crud.delete_book(db, book_id=book_id)
+    return db_book
+
+@app.post("/books/batch/", response_model=list[schemas.Book])
+async def create_books(books: list[schemas.BookCreate], db: AsyncSession = Depends(get_db)):
+    check_batch_size(books)
+    return await crud.create_books(db, books=books)
 
 @app.post("/books/", response_model=schemas.Book)
-def create_book(book: schemas.BookCreate):
-    db = SessionLocal()
-    try:
-        db_book = crud.create_book(db, book=book)
-        return db_book
-    finally:
-        db.close()
+async def create_book(book: schemas.BookCreate, db: AsyncSession = Depends(get_db)):
+    db_book = await crud.create_book(db, book=book)
+    return db_book
 
 @app.get("/books/search/", response_model=list[schemas.Book])
-def search_books(title: str = None, author: str = None, genre: str = None, rating: float = None):
-    db = SessionLocal()
+async def search_books(request: Request, q: str = None, title: str = None, author: str = None, genre: str = None, rating: float = None,
+                 skip: int = Query(0, ge=0), limit: int = Query(search.DEFAULT_LIMIT, ge=1, le=search.MAX_LIMIT),
+                 fields: list[str] = Depends(book_fields), db: AsyncSession = Depends(get_db)):
+    async def produce():
+        books = await crud.search_books(db, q=q, title=title, author=author, genre=genre, rating=rating,
+                                        skip=skip, limit=limit, fields=fields)
+        body = book_list_json(books, fields)
+        return body, [BOOK_SEARCH_TAG] + [book_tag(book.id) for book in books], list_validators(body)
+    key = "books:search:" + json.dumps([q, title, author, genre, rating, skip, limit, fields])
+    return cached_json_response(request, await cached(key, produce))
+
+async def ranked_page_response(request: Request, order: str, genre: Optional[str], cursor: Optional[str],
+                               limit: int, db: AsyncSession):
+    async def produce():
+        books, next_cursor = await crud.get_books_page(db, order=order, cursor=cursor, limit=limit, genre=genre)
+        percentiles = await ranking.genre_percentiles(db, books)
+        items = [
+            schemas.RankedBook(**{name: getattr(book, name) for name in schemas.field_names(schemas.Book)},
+                               save_count=book.save_count, score=book.score,
+                               genre_percentile=percentiles.get(book.id))
+            for book in books
+        ]
+        body = json_bytes(schemas.RankedBookPage(items=items, next_cursor=next_cursor))
+        return body, [BOOK_RANKINGS_TAG], list_validators(body)
+    key = "rankings:" + json.dumps([order, genre, cursor, limit])
     try:
-        books = crud.search_books(db, title=title, author=author, genre=genre, rating=rating)
-        return books
-    finally:
-        db.close()
+        return cached_json_response(request, await cached(key, produce))
+    except pagination.InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+@app.get("/rankings/most-saved/", response_model=schemas.RankedBookPage)
+async def read_most_saved(request: Request, genre: Optional[str] = None, cursor: Optional[str] = None,
+                          limit: int = Query(50, ge=1, le=200), db: AsyncSession = Depends(get_db)):
+    return await ranked_page_response(request, "saves", genre, cursor, limit, db)
+
+@app.get("/rankings/top-rated/", response_model=schemas.RankedBookPage)
+async def read_top_rated(request: Request, genre: Optional[str] = None, cursor: Optional[str] = None,
+                         limit: int = Query(50, ge=1, le=200), db: AsyncSession = Depends(get_db)):
+    # Ordered by the Bayesian score, so a single 5-star save does not outrank well-loved books;
+    # books nobody has saved yet have no score and are not listed
+    return await ranked_page_response(request, "score", genre, cursor, limit, db)
+
+@app.get("/rankings/genres/", response_model=list[schemas.GenreRatingStats])
+async def read_genre_stats(request: Request, db: AsyncSession = Depends(get_db)):
+    async def produce():
+        body = json_bytes(await ranking.genre_stats(db))
+        return body, [BOOK_RANKINGS_TAG], {"etag": body_etag(body)}
+    return cached_json_response(request, await cached("rankings:genres", produce))
+
+@app.get("/rankings/genres/{genre}", response_model=schemas.GenreRatingStats)
+async def read_genre_stat(genre: str, db: AsyncSession = Depends(get_db)):
+    stats = await ranking.genre_stats(db, genre=genre)
+    if not stats:
+        raise HTTPException(status_code=404, detail="Genre not found")
+    return stats[0]
+
+@app.get("/books/facets/", response_model=schemas.Facets)
+async def read_book_facets(request: Request, q: str = None, title: str = None, author: str = None, genre: str = None,
+                           rating: float = None,
+                           limit: int = Query(facets.DEFAULT_FACET_LIMIT, ge=1, le=facets.MAX_FACET_LIMIT),
+                           db: AsyncSession = Depends(get_db)):
+    async def produce():
+        body = json_bytes(await facets.facet_counts(db, q=q, title=title, author=author, genre=genre,
+                                                    rating=rating, limit=limit))
+        return body, [BOOK_SEARCH_TAG], {"etag": body_etag(body)}
+    key = "books:facets:" + json.dumps([q, title, author, genre, rating, limit])
+    return cached_json_response(request, await cached(key, produce))
+
+# Prometheus scrape endpoint; the JSON endpoints below remain for ad-hoc inspection
+@app.get("/metrics")
+async def read_metrics():
+    pool = pool_metrics.snapshot(async_engine.pool)
+    body = instrumentation.render_prometheus(
+        *instrumentation.request_metrics.samples(),
+        *instrumentation.snapshot_samples(
+            "litrank_db_pool", pool,
+            counters={"checkouts", "checkins", "connects", "invalidations", "waits", "wait_seconds", "timeouts"},
+        ),
+        *instrumentation.snapshot_samples(
+            "litrank_cache", await response_cache.stats(),
+            counters={"hits", "misses", "evictions", "invalidations"},
+        ),
+        *instrumentation.snapshot_samples(
+            "litrank_password_hasher", hasher.metrics(),
+            counters={"completed", "rejected", "rehashed", "wait_seconds", "hash_seconds"},
+        ),
+    )
+    return Response(body, media_type=instrumentation.PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/metrics/pool")
+async def read_pool_metrics():
+    return pool_metrics.snapshot(async_engine.pool)
+
+@app.get("/metrics/cache")
+async def read_cache_metrics():
+    return await response_cache.stats()
+
+@app.get("/metrics/passwords")
+async def read_password_metrics():
+    return hasher.metrics()
 
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate):
-    db = SessionLocal()
-    try:
-        db_user = crud.create_user(db, user=user)
-        return db_user
-    finally:
-        db.close()
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.create_user(db, user=user)
+    return db_user
+
+@app.post("/users/{user_id}/books/batch/", response_model=schemas.UserBookBatchResult)
+async def update_user_books(user_id: int, batch: schemas.UserBookBatch, db: AsyncSession = Depends(get_db)):
+    check_batch_size(batch.add + batch.remove)
+    result = await crud.update_user_books(db, user_id=user_id, add=batch.add, remove=batch.remove)
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return result
 
 @app.post("/users/{user_id}/books/{book_id}/", response_model=schemas.UserBook)
-def add_book_to_user(user_id: int, book_id: int):
-    db = SessionLocal()
-    try:
-        user_book = crud.add_book_to_user(db, user_id=user_id, book_id=book_id)
-        if not user_book:
-            raise HTTPException(status_code=404, detail="User or Book not found")
-        return user_book
-    finally:
-        db.close()
+async def add_book_to_user(user_id: int, book_id: int, db: AsyncSession = Depends(get_db)):
+    user_book = await crud.add_book_to_user(db, user_id=user_id, book_id=book_id)
+    if not user_book:
+        raise HTTPException(status_code=404, detail="User or Book not found")
+    return user_book
+
+@app.get("/users/{user_id}/books/", response_model=list[int])
+async def read_user_book_ids(user_id: int, book_ids: Optional[list[int]] = Query(None),
+                             db: AsyncSession = Depends(get_db)):
+    if book_ids is not None:
+        check_batch_size(book_ids)
+    return await crud.get_user_book_ids(db, user_id=user_id, book_ids=book_ids)
 
 @app.get("/users/{user_id}/books/{book_id}/", response_model=bool)
-def check_book_in_user_list(user_id: int, book_id: int):
-    db = SessionLocal()
-    try:
-        is_in_list = crud.check_book_in_user_list(db, user_id=user_id, book_id=book_id)
-        return is_in_list
-    finally:
-        db.close()
+async def check_book_in_user_list(user_id: int, book_id: int, db: AsyncSession = Depends(get_db)):
+    is_in_list = await crud.check_book_in_user_list(db, user_id=user_id, book_id=book_id)
+    return is_in_list
         
 @app.delete("/users/{user_id}/books/{book_id}/", response_model=schemas.UserBook)
-def remove_book_from_user(user_id: int, book_id: int):
-    db = SessionLocal()
-    try:
-        user_book = crud.remove_book_from_user(db, user_id=user_id, book_id=book_id)
-        if not user_book:
-            raise HTTPException(status_code=404, detail="User or Book not found")
-        return user_book
-    finally:
-        db.close()
-
-        from fastapi.responses import FileResponse
-
-
-from fastapi.responses import FileResponse
-
-@app.get("/", response_class=FileResponse)
-def serve_index():
-    return "frontend/index.html"
-
-@app.get("/impressum.html", response_class=FileResponse)
-def serve_impressum():
-    return "frontend/impressum.html"
+async def remove_book_from_user(user_id: int, book_id: int, db: AsyncSession = Depends(get_db)):
+    user_book = await crud.remove_book_from_user(db, user_id=user_id, book_id=book_id)
+    if not user_book:
+        raise HTTPException(status_code=404, detail="User or Book not found")
+    return user_book
 
-@app.get("/map.html", response_class=FileResponse)
-def serve_map():
-    return "frontend/map.html"
 
-@app.get("/contact.html", response_class=FileResponse)
-def serve_contact():
-    return "frontend/contact.html"
+# Pages are served from the asset build too, precompressed and revalidated with their ETag
+PAGES = ["index", "impressum", "map", "contact", "search"]
 
-@app.get("/search.html", response_class=FileResponse)
-def serve_search():
-    return "frontend/search.html"
+@app.get("/", include_in_schema=False)
+async def serve_index(request: Request):
+    return static_assets.response("index.html", request.headers)
 
-@app.get("/index.html", response_class=FileResponse)
-def serve_index_alias():
-    return "frontend/index.html"
+@app.get("/{page}.html", include_in_schema=False)
+async def serve_page(request: Request, page: str):
+    if page not in PAGES:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return static_assets.response(f"{page}.html", request.headers)
 
 
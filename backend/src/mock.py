@@ -1,26 +1,13 @@
-import csv
+import os
 
-from database import SessionLocal, engine
-from . import models
-
-models.Base.metadata.create_all(bind=engine)
+from .database import engine
+from .importer import import_books
 
 def fill_database_with_mock_data(csv_file_path: str):
-    with open(csv_file_path, mode='r') as file:
-        csv_reader = csv.DictReader(file)
-        with SessionLocal() as session:
-            for row in csv_reader:
-                book = models.Book(
-                    id=row['id'],
-                    title=row['title'],
-                    author=row['author'],
-                    genre=row['genre'],
-                    rating=row['rating'],
-                    image_url=row['image_url']
-                )
-                session.add(book)
-            session.commit()
+    # Delegates to the bulk importer, which upserts on id so re-running is safe.
+    # The tables come from the migrations: run `alembic -c backend/alembic.ini upgrade head` first.
+    return import_books(engine, csv_file_path)
 
 
 if __name__ == '__main__':
-    fill_database_with_mock_data('./data/mock_data.csv')
\ No newline at end of file
+    fill_database_with_mock_data(os.path.join(os.path.dirname(__file__), '..', 'data', 'mock.csv'))
@@ -1,7 +1,16 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, String, Float, ForeignKey, Index, UniqueConstraint, DDL, event, func
 from sqlalchemy.orm import relationship
 from .database import Base
 
+# Full-text document for a book. The search query reuses this exact SQL so that
+# Postgres can match it against the expression index created below.
+BOOK_SEARCH_DOCUMENT = (
+    "to_tsvector('simple'::regconfig, "
+    "coalesce(title, '') || ' ' || coalesce(author, '') || ' ' || coalesce(genre, ''))"
+)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -21,13 +30,126 @@ class Book(Base):
     rating = Column(Float)
     image_url = Column(String)
     description = Column(String)
+    # Normalized copies of author and genre, maintained by the facets module
+    author_id = Column(Integer, ForeignKey("authors.id"), index=True)
+    genre_id = Column(Integer, ForeignKey("genres.id"), index=True)
+    # Bumped by SQLAlchemy on every update; together with updated_at it backs HTTP validators.
+    # Bulk updates of the aggregates below set updated_at to itself, so both only move together.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+    )
+    # Ranking aggregates, maintained incrementally by the ranking module
+    save_count = Column(Integer, nullable=False, default=0, server_default="0")
+    score = Column(Float)
     users = relationship("UserBook", back_populates="book")
 
+    __table_args__ = (
+        # Back keyset pagination over the (rating, id), (save_count, id) and (score, id) orderings,
+        # overall and within a genre
+        Index("ix_books_rating_id", "rating", "id"),
+        Index("ix_books_save_count_id", "save_count", "id"),
+        Index("ix_books_score_id", "score", "id"),
+        Index("ix_books_genre_save_count_id", "genre", "save_count", "id"),
+        Index("ix_books_genre_score_id", "genre", "score", "id"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
 class UserBook(Base):
     __tablename__ = "user_books"
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'))
-    book_id = Column(Integer, ForeignKey('books.id'))
+    book_id = Column(Integer, ForeignKey('books.id'), index=True)
     user = relationship("User", back_populates="books")
-    book = relationship("Book", back_populates="users")
\ No newline at end of file
+    book = relationship("Book", back_populates="users")
+
+    __table_args__ = (
+        # A book is on a user's list at most once; makes adding idempotent and
+        # serves membership lookups by (user_id, book_id)
+        UniqueConstraint("user_id", "book_id", name="uq_user_books_user_id_book_id"),
+    )
+
+class Genre(Base):
+    __tablename__ = "genres"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    # Books per genre, kept current on every book write so facets need no GROUP BY
+    book_count = Column(Integer, nullable=False, default=0, index=True)
+
+class Author(Base):
+    __tablename__ = "authors"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    book_count = Column(Integer, nullable=False, default=0, index=True)
+
+class GenreAuthorCount(Base):
+    """Books per (genre, author) pair; answers facet counts within a selected genre or author."""
+
+    __tablename__ = "genre_author_counts"
+
+    genre_id = Column(Integer, ForeignKey("genres.id"), primary_key=True)
+    author_id = Column(Integer, ForeignKey("authors.id"), primary_key=True)
+    book_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Top authors within one genre, and top genres for one author, in count order
+        Index("ix_genre_author_counts_genre_id_book_count", "genre_id", "book_count"),
+        Index("ix_genre_author_counts_author_id_book_count", "author_id", "book_count"),
+    )
+
+class GenreRatingBucket(Base):
+    """Number of books of a genre whose rating rounds to bucket / 10 stars."""
+
+    __tablename__ = "genre_rating_buckets"
+
+    genre = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    book_count = Column(Integer, nullable=False, default=0)
+
+class SimilarityChange(Base):
+    """Book whose similar-books vectors changed; every machine's index reads the log past its own position."""
+
+    __tablename__ = "similarity_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    book_id = Column(Integer, nullable=False)
+    # Rows are pruned by age, not consumed
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now(),
+        index=True,
+    )
+
+    # Ids are log positions: SQLite must never reuse them, even once old rows are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+# Postgres search indexes: a GIN index over the tsvector document for ranked
+# full-text queries, and trigram indexes so that fuzzy matches and the
+# ILIKE '%term%' filters can use an index instead of a sequential scan.
+event.listen(
+    Book.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+for ddl in (
+    f"CREATE INDEX IF NOT EXISTS ix_books_search_document ON books USING gin ({BOOK_SEARCH_DOCUMENT})",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_genre_trgm ON books USING gin (genre gin_trgm_ops)",
+):
+    event.listen(Book.__table__, "after_create", DDL(ddl).execute_if(dialect="postgresql"))
+# Facet filters match author and genre names by substring
+for table in (Author.__table__, Genre.__table__):
+    event.listen(table, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+    event.listen(table, "after_create", DDL(
+        f"CREATE INDEX IF NOT EXISTS ix_{table.name}_name_trgm ON {table.name} USING gin (name gin_trgm_ops)"
+    ).execute_if(dialect="postgresql"))
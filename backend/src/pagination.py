@@ -0,0 +1,44 @@
+import base64
+import json
+
+# Orderings supported by keyset pagination, mapped to the columns that make up the cursor
+BOOK_ORDERINGS = {
+    "id": ("id",),
+    "rating": ("rating", "id"),
+    "saves": ("save_count", "id"),
+    "score": ("score", "id"),
+}
+
+# JSON types accepted for each cursor column; anything else would reach the database as a bad comparison
+COLUMN_TYPES = {
+    "id": (int,),
+    "save_count": (int,),
+    "rating": (int, float),
+    "score": (int, float),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(order: str, values) -> str:
+    payload = json.dumps({"o": order, "k": list(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(order: str, cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["k"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("Malformed cursor")
+    # A cursor is only valid for the ordering it was issued for
+    if not isinstance(values, list) or payload.get("o") != order or len(values) != len(BOOK_ORDERINGS[order]):
+        raise InvalidCursor("Cursor does not match the requested ordering")
+    for column, value in zip(BOOK_ORDERINGS[order], values):
+        # bool is an int subclass, but never a valid key
+        if isinstance(value, bool) or not isinstance(value, COLUMN_TYPES[column]):
+            raise InvalidCursor("Malformed cursor")
+    return values
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+from passlib.context import CryptContext
+
+# bcrypt work factor; raising it makes existing hashes get upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Number of hashes computed at the same time, and how many more may wait for a slot
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+# "thread" (bcrypt releases the GIL) or "process"
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashing requests are already waiting."""
+
+
+@lru_cache(maxsize=None)
+def _context(rounds):
+    # Built lazily so that process-pool workers create their own instance
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+
+def _hash(rounds, password):
+    return _context(rounds).hash(password)
+
+
+def _verify_and_update(rounds, password, hashed_password):
+    return _context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded worker pool instead of on the event loop."""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=PASSWORD_HASH_WORKERS,
+                 max_queue=PASSWORD_HASH_MAX_QUEUE, executor=PASSWORD_HASH_EXECUTOR):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor_kind = executor
+        self._executor = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.executor_kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            return self._executor
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("Too many password hashing requests in progress")
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        started_at = time.perf_counter()
+        self.wait_seconds += started_at - queued_at
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, self.rounds, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.hash_seconds += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def hash(self, password):
+        return await self._run(_hash, password)
+
+    async def verify_and_update(self, password, hashed_password):
+        """Return (valid, new_hash); new_hash is set when the stored hash uses outdated settings."""
+        valid, new_hash = await self._run(_verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def metrics(self):
+        return {
+            "workers": self.workers,
+            "executor": self.executor_kind,
+            "rounds": self.rounds,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "wait_seconds": round(self.wait_seconds, 6),
+            "hash_seconds": round(self.hash_seconds, 6),
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+
+
+class PrincipalCache:
+    """LRU/TTL cache of authenticated users keyed by the token's (sub, iat).
+
+    Invalidating a user drops their cached entries and records a watermark, so
+    tokens issued before the change are no longer trusted on their claims alone.
+    Invalidation is per process; other workers catch up when their entries expire.
+    """
+
+    def __init__(self, maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL, max_token_age=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Watermarks older than the token lifetime can never matter again
+        self.max_token_age = max_token_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_sub = defaultdict(set)
+        self._invalidated_at = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sub, iat):
+        key = (sub, iat)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or self._is_stale(sub, iat):
+                if entry is not None:
+                    self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, sub, iat, principal):
+        key = (sub, iat)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(key)
+            self._keys_by_sub[sub].add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, sub):
+        with self._lock:
+            for key in self._keys_by_sub.pop(sub, ()):
+                self._entries.pop(key, None)
+            now = time.time()
+            self._invalidated_at[sub] = now
+            if self.max_token_age is not None:
+                cutoff = now - self.max_token_age
+                for stale_sub in [s for s, at in self._invalidated_at.items() if at < cutoff]:
+                    del self._invalidated_at[stale_sub]
+
+    def is_stale(self, sub, iat):
+        """True if the user changed after the token was issued (or the token has no iat)."""
+        with self._lock:
+            return self._is_stale(sub, iat)
+
+    def _is_stale(self, sub, iat):
+        return iat is None or iat < self._invalidated_at.get(sub, 0)
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        keys = self._keys_by_sub.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_sub[key[0]]
+
+    def metrics(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache()
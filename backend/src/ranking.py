@@ -0,0 +1,212 @@
+"""Popularity and rating aggregates behind the ranked listings.
+
+Each book carries its save count and a Bayesian score, and ratings are kept as
+per-genre histograms for percentiles. All of it is updated incrementally inside
+the transactions that change books or reading lists, so ranked pages are plain
+index scans. Books nobody has saved have no score: there is no evidence to
+rank them by, so they are left out of the score ordering. Run this module to
+recompute everything:
+
+    python -m backend.src.ranking
+"""
+import math
+import os
+from collections import Counter, defaultdict
+
+from sqlalchemy import case, cast, delete, func, insert, select, update, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import increment_counts
+
+# Weight of the prior in the Bayesian score, in "saves": a book needs this many
+# saves before its own rating counts as much as the catalogue average
+RANKING_PRIOR_WEIGHT = float(os.getenv("RANKING_PRIOR_WEIGHT", "10"))
+# Prior used while no book has a rating yet
+DEFAULT_PRIOR_RATING = 3.0
+
+# Ratings are histogrammed per genre in steps of 0.1 stars, rounding halves up
+# (rating_bucket and bucket_expression must agree, or deletes miss their bucket)
+BUCKETS_PER_STAR = 10
+MAX_BUCKET = 5 * BUCKETS_PER_STAR
+PERCENTILES = (25, 50, 75, 90)
+
+
+def rating_bucket(rating):
+    if rating is None:
+        return None
+    return min(max(math.floor(rating * BUCKETS_PER_STAR + 0.5), 0), MAX_BUCKET)
+
+
+def bucket_expression(rating, dialect_name):
+    """SQL for rating_bucket. SQLite's CAST truncates, which is floor for the non-negative values kept."""
+    shifted = rating * BUCKETS_PER_STAR + 0.5
+    bucket = cast(func.floor(shifted) if dialect_name == "postgresql" else shifted, Integer)
+    return case((bucket < 0, 0), (bucket > MAX_BUCKET, MAX_BUCKET), else_=bucket)
+
+
+def bayesian_score(save_count, rating, prior_rating, weight=RANKING_PRIOR_WEIGHT):
+    """Rating shrunk towards the catalogue average; books with few saves cannot top the ranking."""
+    if rating is None or not save_count:
+        return None
+    return (save_count * rating + weight * prior_rating) / (save_count + weight)
+
+
+def _score_expression(save_count, prior_rating, weight=RANKING_PRIOR_WEIGHT):
+    rating = models.Book.rating
+    return case(
+        (rating.is_(None), None),
+        (save_count <= 0, None),
+        else_=(save_count * rating + weight * prior_rating) / (save_count + weight),
+    )
+
+
+async def prior_rating(db: AsyncSession):
+    """Catalogue-wide mean rating, read from the genre histograms (a few hundred rows at most)."""
+    buckets = models.GenreRatingBucket
+    total, weighted = (await db.execute(
+        select(func.sum(buckets.book_count), func.sum(buckets.bucket * buckets.book_count))
+    )).one()
+    if not total:
+        return DEFAULT_PRIOR_RATING
+    return weighted / total / BUCKETS_PER_STAR
+
+
+async def books_changed(db: AsyncSession, before=(), after=()):
+    """Keep genre histograms and scores in step with book writes.
+
+    before holds the (genre, rating) of books as they were, after the ORM
+    objects as they will be; creates pass only after, deletes only before.
+    Runs inside the caller's transaction, before its commit.
+    """
+    counts = Counter()
+    for genre, rating in before:
+        if genre is not None and rating is not None:
+            counts[(genre, rating_bucket(rating))] -= 1
+    for book in after:
+        if book.genre is not None and book.rating is not None:
+            counts[(book.genre, rating_bucket(book.rating))] += 1
+    await increment_counts(
+        db, models.GenreRatingBucket.__table__, ["genre", "bucket"],
+        [{"genre": genre, "bucket": bucket, "book_count": count} for (genre, bucket), count in counts.items()],
+    )
+    if after:
+        prior = await prior_rating(db)
+        for book in after:
+            book.score = bayesian_score(book.save_count or 0, book.rating, prior)
+
+
+async def saves_changed(db: AsyncSession, book_ids, delta: int):
+    """Add delta to the save count of each book and rescore it, in one UPDATE."""
+    if not book_ids:
+        return
+    prior = await prior_rating(db)
+    save_count = models.Book.save_count + delta
+    await db.execute(
+        update(models.Book)
+        .where(models.Book.id.in_(book_ids))
+        # Aggregates are not part of a book's representation: keep updated_at, which would
+        # otherwise move without version and make Last-Modified disagree with the ETag
+        .values(save_count=save_count, score=_score_expression(save_count, prior),
+                updated_at=models.Book.updated_at)
+        # The rows are not loaded; the session must not try to synchronize them
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def genre_stats(db: AsyncSession, genre: str = None):
+    """Book count, mean rating and rating percentiles per genre, from the histograms."""
+    buckets = models.GenreRatingBucket
+    statement = select(buckets.genre, buckets.bucket, buckets.book_count).where(buckets.book_count > 0)
+    if genre is not None:
+        statement = statement.where(buckets.genre == genre)
+    histograms = defaultdict(list)
+    for row in await db.execute(statement.order_by(buckets.genre, buckets.bucket)):
+        histograms[row.genre].append((row.bucket, row.book_count))
+    return [_summarize(name, histogram) for name, histogram in histograms.items()]
+
+
+def _summarize(genre, histogram):
+    total = sum(count for _, count in histogram)
+    percentiles = {}
+    seen = 0
+    targets = iter(PERCENTILES)
+    target = next(targets)
+    for bucket, count in histogram:
+        seen += count
+        while target is not None and seen >= total * target / 100:
+            percentiles[f"p{target}"] = bucket / BUCKETS_PER_STAR
+            target = next(targets, None)
+    return {
+        "genre": genre,
+        "book_count": total,
+        "mean_rating": round(sum(bucket * count for bucket, count in histogram) / total / BUCKETS_PER_STAR, 2),
+        "percentiles": percentiles,
+    }
+
+
+async def genre_percentiles(db: AsyncSession, books):
+    """Percentile of each book's rating within its genre, keyed by book id."""
+    genres = {book.genre for book in books if book.genre is not None and book.rating is not None}
+    if not genres:
+        return {}
+    buckets = models.GenreRatingBucket
+    histograms = defaultdict(dict)
+    for row in await db.execute(
+        select(buckets.genre, buckets.bucket, buckets.book_count).where(buckets.genre.in_(genres))
+    ):
+        histograms[row.genre][row.bucket] = row.book_count
+    result = {}
+    for book in books:
+        histogram = histograms.get(book.genre)
+        total = sum(histogram.values()) if histogram else 0
+        if not total or book.rating is None:
+            continue
+        bucket = rating_bucket(book.rating)
+        below = sum(count for other, count in histogram.items() if other < bucket)
+        # Ties count half, so the middle of a run of equal ratings sits at its midpoint
+        result[book.id] = round(100 * (below + histogram.get(bucket, 0) / 2) / total, 1)
+    return result
+
+
+def rebuild(connection):
+    """Recompute every aggregate from scratch (sync; for importers and repairs).
+
+    Incremental updates score books with the prior of the moment, so scores
+    drift slightly as the catalogue average moves; a rebuild realigns them.
+    """
+    books = models.Book.__table__
+    user_books = models.UserBook.__table__
+    buckets = models.GenreRatingBucket.__table__
+    connection.execute(
+        update(books).values(
+            save_count=select(func.count()).select_from(user_books)
+            .where(user_books.c.book_id == books.c.id).scalar_subquery(),
+            # Leave the books' validators alone, as saves_changed does
+            updated_at=books.c.updated_at,
+        )
+    )
+    bucket = bucket_expression(books.c.rating, connection.dialect.name)
+    connection.execute(delete(buckets))
+    connection.execute(
+        insert(buckets).from_select(
+            ["genre", "bucket", "book_count"],
+            select(books.c.genre, bucket, func.count())
+            .where(books.c.genre.isnot(None), books.c.rating.isnot(None))
+            .group_by(books.c.genre, bucket),
+        )
+    )
+    total, weighted = connection.execute(
+        select(func.sum(buckets.c.book_count), func.sum(buckets.c.bucket * buckets.c.book_count))
+    ).one()
+    prior = weighted / total / BUCKETS_PER_STAR if total else DEFAULT_PRIOR_RATING
+    connection.execute(
+        update(books).values(score=_score_expression(books.c.save_count, prior), updated_at=books.c.updated_at)
+    )
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    with engine.begin() as connection:
+        rebuild(connection)
@@ -0,0 +1,534 @@
+"""Content and co-occurrence based "similar books".
+
+Every book has two unit vectors, stored as float32 matrices indexed by book id
+and memory-mapped from .npy files:
+
+- content: TF-IDF over title and description, hashed into
+  RECOMMEND_CONTENT_DIMENSIONS buckets, plus hashed genre and author features;
+- saves: a count sketch of the users who saved the book. The dot product of two
+  rows estimates the cosine of their user sets, i.e. normalized co-occurrence
+  in user_books.
+
+Similarity is a weighted sum of both cosines. Small catalogues are scored in
+full, in one matrix-vector product per matrix. Larger ones are split into
+clusters of about RECOMMEND_CLUSTER_SIZE books (spherical k-means over both
+vectors side by side), and a query only scores the books of its
+RECOMMEND_PROBES closest clusters.
+
+The index is built offline, from the database:
+
+    python -m backend.src.recommend
+
+On Heroku this runs from bin/post_compile, so the files ship in the slug and
+every dyno starts with them. Web processes never build. They map the files,
+and one process per machine, holding the writer lock, applies the books that
+book and reading-list writes log in similarity_changes within their
+transaction. It does so every RECOMMEND_REFRESH_SECONDS, in small batches. Other
+processes map the same files read-only and reopen them when the writer
+publishes a new generation. Document frequencies and cluster centroids stay
+those of the build until the next one.
+
+The log is shared by every machine, so nobody consumes it: each index records
+the last change id it applied in its meta.json and reads only newer rows.
+Ids skipped on the way belong to transactions that have not committed yet (or
+never will) and are rechecked for a while. Rows are pruned once they are
+RECOMMEND_CHANGE_RETENTION_SECONDS old; an index built longer ago than that
+may have missed changes and needs a new build.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from . import models
+from .search import tokenize
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: every process then maintains the index, which is wasteful but safe
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Inside the application, so that an index built at slug compile time reaches every dyno and survives restarts
+RECOMMEND_DIR = os.getenv(
+    "RECOMMEND_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "recommend")
+)
+RECOMMEND_CONTENT_DIMENSIONS = int(os.getenv("RECOMMEND_CONTENT_DIMENSIONS", "256"))
+RECOMMEND_SAVES_DIMENSIONS = int(os.getenv("RECOMMEND_SAVES_DIMENSIONS", "128"))
+# Share of the score coming from co-occurrence, for books that have been saved at all
+RECOMMEND_SAVES_WEIGHT = float(os.getenv("RECOMMEND_SAVES_WEIGHT", "0.4"))
+RECOMMEND_REFRESH_SECONDS = float(os.getenv("RECOMMEND_REFRESH_SECONDS", "30"))
+# How long logged changes are kept for every machine's writer to read. A restarted dyno replays
+# them from its slug's build, so this should outlast the time between deploys.
+RECOMMEND_CHANGE_RETENTION_SECONDS = float(os.getenv("RECOMMEND_CHANGE_RETENTION_SECONDS", str(30 * 86400)))
+# Books per cluster, and clusters scored per query; catalogues of up to RECOMMEND_PROBES clusters are scanned in full
+RECOMMEND_CLUSTER_SIZE = int(os.getenv("RECOMMEND_CLUSTER_SIZE", "1000"))
+RECOMMEND_PROBES = int(os.getenv("RECOMMEND_PROBES", "8"))
+
+# Weights of the genre and author features next to the unit-length text vector
+GENRE_WEIGHT = 0.5
+AUTHOR_WEIGHT = 0.5
+DEFAULT_K = 10
+MAX_K = 50
+BATCH_SIZE = 5000
+# Vectors are computed in pure Python and hold the GIL: web processes apply changes in
+# batches this small, back to back while catching up, so requests never wait long
+REFRESH_BATCH_SIZE = 500
+CATCH_UP_SECONDS = 1.0
+# Training rows per cluster and iterations for the k-means of a build
+KMEANS_SAMPLE_PER_CLUSTER = 20
+KMEANS_ITERATIONS = 10
+# Skipped change ids are rechecked this long; no write transaction runs longer
+PENDING_CHANGE_SECONDS = 600
+
+
+class IndexNotReady(Exception):
+    """Raised while no index has been built for this machine yet."""
+
+
+def _bucket(feature, dimensions):
+    value = zlib.crc32(feature.encode("utf-8"))
+    # The top bit picks the sign, so colliding features tend to cancel out instead of adding up
+    return value % dimensions, 1.0 if value & 0x80000000 else -1.0
+
+
+def _normalized(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def content_vector(title, description, genre, author, vocabulary, documents,
+                   dimensions=RECOMMEND_CONTENT_DIMENSIONS):
+    """Unit vector of a book's text, genre and author; vocabulary maps tokens to document frequency."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    counts = Counter(tokenize(title)) + Counter(tokenize(description))
+    for token, count in counts.items():
+        idf = math.log((1 + documents) / (1 + vocabulary.get(token, 0))) + 1
+        index, sign = _bucket(token, dimensions)
+        vector[index] += sign * (1 + math.log(count)) * idf
+    vector = _normalized(vector)
+    for feature, weight in ((genre and f"genre:{genre.strip().lower()}", GENRE_WEIGHT),
+                            (author and f"author:{author.strip().lower()}", AUTHOR_WEIGHT)):
+        if feature:
+            index, sign = _bucket(feature, dimensions)
+            vector[index] += sign * weight
+    return _normalized(vector)
+
+
+def saves_vector(user_ids, dimensions=RECOMMEND_SAVES_DIMENSIONS):
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for user_id in user_ids:
+        index, sign = _bucket(f"user:{user_id}", dimensions)
+        vector[index] += sign
+    return _normalized(vector)
+
+
+def _joint(content, saves):
+    """Both vectors side by side, weighted so that dot products approximate the blended score."""
+    return np.concatenate(
+        [content * math.sqrt(1 - RECOMMEND_SAVES_WEIGHT), saves * math.sqrt(RECOMMEND_SAVES_WEIGHT)], axis=-1
+    )
+
+
+def _kmeans(vectors, clusters, iterations=KMEANS_ITERATIONS):
+    """Unit centroids of clusters groups of the rows of vectors, by cosine (spherical k-means)."""
+    centroids = vectors[np.random.default_rng(0).choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # A cluster left empty keeps its centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+    return centroids.astype(np.float32)
+
+
+def _nearest(centroids, content, saves):
+    """Cluster of each row; -1 for rows without a book."""
+    labels = np.argmax(_joint(content, saves) @ centroids.T, axis=1).astype(np.int32)
+    labels[~content.any(axis=1)] = -1
+    return labels
+
+
+def _ago(seconds):
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+def _partitions(connection, statement):
+    return connection.execution_options(stream_results=True, yield_per=BATCH_SIZE).execute(statement).partitions()
+
+
+class SimilarityIndex:
+    def __init__(self, directory=RECOMMEND_DIR):
+        self.directory = directory
+        self.content = None
+        self.saves = None
+        # Cluster of each row and the centroids; None when the catalogue is scanned in full
+        self.clusters = None
+        self.centroids = None
+        self.vocabulary = {}
+        self.documents = 0
+        self.generation = None
+        # Change log position: last id applied, skipped ids still expected (id -> first seen), last sync time
+        self.last_change = 0
+        self.pending = {}
+        self.synced_at = None
+        self.writable = False
+        self._meta_mtime = None
+        self._lock_file = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self):
+        """Map the current generation of the index, if it changed; return False when there is none."""
+        try:
+            mtime = os.stat(self._path("meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._meta_mtime:
+            return True
+        with open(self._path("meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        if "clusters" not in meta or (meta["content_dimensions"], meta["saves_dimensions"]) != (
+                RECOMMEND_CONTENT_DIMENSIONS, RECOMMEND_SAVES_DIMENSIONS):
+            # Built by an older version or with other settings; unusable until the next build
+            return False
+        generation = meta["generation"]
+        if generation != self.generation or self.content is None:
+            mode = "r+" if self.writable else "r"
+            try:
+                content = np.load(self._path(f"content.{generation}.npy"), mmap_mode=mode)
+                saves = np.load(self._path(f"saves.{generation}.npy"), mmap_mode=mode)
+                clusters = centroids = None
+                if meta["clusters"]:
+                    clusters = np.load(self._path(f"clusters.{generation}.npy"), mmap_mode=mode)
+                    centroids = np.load(self._path(f"centroids.{generation}.npy"))
+            except FileNotFoundError:
+                # Superseded while we read meta.json; keep the current mapping and pick up the newer one next time
+                return self.content is not None
+            self.content, self.saves, self.clusters, self.centroids = content, saves, clusters, centroids
+            if self.writable:
+                with open(self._path(f"vocabulary.{generation}.json"), encoding="utf-8") as file:
+                    self.vocabulary = json.load(file)
+            self.generation = generation
+        self.documents = meta["documents"]
+        self.last_change = meta["last_change"]
+        self.pending = {int(change_id): seen for change_id, seen in meta["pending"].items()}
+        self.synced_at = meta["synced_at"]
+        self._meta_mtime = mtime
+        return True
+
+    def stale(self):
+        """True when changes this index has not applied may already have been pruned from the log."""
+        return self.synced_at is None or time.time() - self.synced_at > RECOMMEND_CHANGE_RETENTION_SECONDS
+
+    def similar(self, book_id, k=DEFAULT_K):
+        """[(book id, score)] of the k books most similar to book_id, best first.
+
+        Returns None when the book has no vectors (unknown, or not indexed yet).
+        """
+        if not self.open():
+            raise IndexNotReady("The similarity index has not been built yet")
+        content, saves, clusters, centroids = self.content, self.saves, self.clusters, self.centroids
+        if book_id < 1 or book_id >= len(content):
+            return None
+        query_content = np.array(content[book_id])
+        if not query_content.any():
+            return None
+        query_saves = np.array(saves[book_id])
+        if centroids is None:
+            candidates = np.arange(len(content))
+            content_rows, saves_rows = content, saves
+        else:
+            closest = np.argsort(-(centroids @ _joint(query_content, query_saves)))[:RECOMMEND_PROBES]
+            candidates = np.flatnonzero(np.isin(clusters, closest))
+            content_rows, saves_rows = content[candidates], saves[candidates]
+        weight = RECOMMEND_SAVES_WEIGHT if query_saves.any() else 0.0
+        scores = content_rows @ (query_content * (1 - weight))
+        if weight:
+            scores += saves_rows @ (query_saves * weight)
+        scores[candidates == book_id] = -np.inf
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(candidates[row]), round(float(scores[row]), 4)) for row in top if scores[row] > 0]
+
+    # Writer side: only the process holding the lock builds and updates the files
+
+    def acquire_writer(self):
+        """Take the machine-wide writer lock without blocking; True if this process is the writer."""
+        if self.writable:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(self._path("writer.lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        self.writable = True
+        self._meta_mtime = None
+        return True
+
+    def release_writer(self):
+        if not self.writable:
+            return
+        self._lock_file.close()
+        self._lock_file = None
+        self.writable = False
+        # Mapped read-only again on the next open()
+        self.content = None
+        self._meta_mtime = None
+
+    def _published_generation(self):
+        """Generation named by meta.json, whatever settings it was built with; 0 when there is none."""
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as file:
+                return json.load(file)["generation"]
+        except FileNotFoundError:
+            return 0
+
+    def _write_meta(self, generation, documents, clusters):
+        meta = {"generation": generation, "documents": documents, "clusters": clusters,
+                "content_dimensions": RECOMMEND_CONTENT_DIMENSIONS, "saves_dimensions": RECOMMEND_SAVES_DIMENSIONS,
+                "last_change": self.last_change, "pending": self.pending, "synced_at": self.synced_at}
+        with open(self._path("meta.tmp"), "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(self._path("meta.tmp"), self._path("meta.json"))
+
+    def _publish(self, generation, content, saves, clusters, centroids, vocabulary, documents):
+        content.flush()
+        saves.flush()
+        if centroids is not None:
+            clusters.flush()
+            np.save(self._path(f"centroids.{generation}.npy"), centroids)
+        with open(self._path(f"vocabulary.{generation}.json"), "w", encoding="utf-8") as file:
+            json.dump(vocabulary, file)
+        previous = self._published_generation()
+        self._write_meta(generation, documents, 0 if centroids is None else len(centroids))
+        self.open()
+        if previous and previous != generation:
+            # Readers that still map the old files keep them until they reopen
+            for name in (f"content.{previous}.npy", f"saves.{previous}.npy", f"clusters.{previous}.npy",
+                         f"centroids.{previous}.npy", f"vocabulary.{previous}.json"):
+                try:
+                    os.remove(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+    def _allocate(self, generation, rows, clustered):
+        content = np.lib.format.open_memmap(self._path(f"content.{generation}.npy"), mode="w+",
+                                            dtype=np.float32, shape=(rows, RECOMMEND_CONTENT_DIMENSIONS))
+        saves = np.lib.format.open_memmap(self._path(f"saves.{generation}.npy"), mode="w+",
+                                          dtype=np.float32, shape=(rows, RECOMMEND_SAVES_DIMENSIONS))
+        clusters = None
+        if clustered:
+            clusters = np.lib.format.open_memmap(self._path(f"clusters.{generation}.npy"), mode="w+",
+                                                 dtype=np.int32, shape=(rows,))
+            clusters[:] = -1
+        return content, saves, clusters
+
+    @staticmethod
+    def _capacity(max_id):
+        # Headroom for new books, so that growing (a full copy) stays rare
+        return max_id + 1 + max(1024, max_id // 4)
+
+    def build(self, connection):
+        """Compute every vector from the database and publish them as a new generation (sync, offline)."""
+        books = models.Book.__table__
+        user_books = models.UserBook.__table__
+        changes = models.SimilarityChange.__table__
+        # Changes logged from here on are applied by the next refresh; recent ids missing below
+        # the newest one may belong to transactions that commit after this build has read their books
+        last_change = connection.execute(select(func.max(changes.c.id))).scalar() or 0
+        recent = connection.execute(
+            select(changes.c.id).where(changes.c.created_at >= _ago(PENDING_CHANGE_SECONDS))
+        ).scalars().all()
+        self.last_change = min(recent) - 1 if recent else last_change
+        self.pending = {}
+        self._track(recent, last_change)
+        self.synced_at = time.time()
+
+        vocabulary, documents = Counter(), 0
+        for rows in _partitions(connection, select(books.c.title, books.c.description)):
+            for title, description in rows:
+                vocabulary.update(set(tokenize(title)) | set(tokenize(description)))
+                documents += 1
+        vocabulary = dict(vocabulary)
+        max_id = connection.execute(select(func.max(books.c.id))).scalar() or 0
+        # Never the published generation: other processes may be mapping its files
+        generation = self._published_generation() + 1
+        cluster_count = documents // RECOMMEND_CLUSTER_SIZE
+        clustered = cluster_count > RECOMMEND_PROBES
+        content, saves, clusters = self._allocate(generation, self._capacity(max_id), clustered)
+
+        for rows in _partitions(connection, select(books.c.id, books.c.title, books.c.description,
+                                                   books.c.genre, books.c.author)):
+            for book_id, title, description, genre, author in rows:
+                content[book_id] = content_vector(title, description, genre, author, vocabulary, documents)
+        book_id, user_ids = None, []
+        statement = select(user_books.c.book_id, user_books.c.user_id).order_by(user_books.c.book_id)
+        for rows in _partitions(connection, statement):
+            for row_book_id, user_id in rows:
+                if row_book_id != book_id:
+                    if user_ids:
+                        saves[book_id] = saves_vector(user_ids)
+                    book_id, user_ids = row_book_id, []
+                user_ids.append(user_id)
+        if user_ids:
+            saves[book_id] = saves_vector(user_ids)
+
+        centroids = None
+        if clustered:
+            indexed = np.flatnonzero(content.any(axis=1))
+            sample = np.random.default_rng(0).choice(
+                indexed, min(len(indexed), cluster_count * KMEANS_SAMPLE_PER_CLUSTER), replace=False
+            )
+            sample.sort()
+            centroids = _kmeans(_joint(content[sample], saves[sample]), min(cluster_count, len(sample)))
+            for start in range(0, len(content), BATCH_SIZE):
+                end = start + BATCH_SIZE
+                clusters[start:end] = _nearest(centroids, content[start:end], saves[start:end])
+
+        self._publish(generation, content, saves, clusters, centroids, vocabulary, documents)
+        return documents
+
+    def _grow(self, rows):
+        generation = self.generation + 1
+        content, saves, clusters = self._allocate(generation, rows, self.centroids is not None)
+        content[:len(self.content)] = self.content
+        saves[:len(self.saves)] = self.saves
+        if clusters is not None:
+            clusters[:len(self.clusters)] = self.clusters
+        self._publish(generation, content, saves, clusters, self.centroids, self.vocabulary, self.documents)
+
+    def _track(self, change_ids, last_change):
+        """Advance the log position to last_change; ids skipped on the way are expected later."""
+        now = time.time()
+        seen = set(change_ids)
+        pending = {change_id: first_seen for change_id, first_seen in self.pending.items()
+                   if change_id not in seen and now - first_seen < PENDING_CHANGE_SECONDS}
+        for change_id in range(self.last_change + 1, last_change):
+            if change_id not in seen:
+                pending[change_id] = now
+        self.pending = pending
+        self.last_change = max(self.last_change, last_change)
+
+    async def refresh(self, connection: AsyncConnection, limit=REFRESH_BATCH_SIZE):
+        """Recompute the vectors of books logged since the last sync; returns how many changes were read.
+
+        Document frequencies and centroids stay those of the last build, so term
+        weights and clusters drift slightly as the catalogue changes; a build
+        realigns them.
+        """
+        changes = models.SimilarityChange.__table__
+        books = models.Book.__table__
+        user_books = models.UserBook.__table__
+        statement = select(changes.c.id, changes.c.book_id)
+        logged = (await connection.execute(
+            statement.where(changes.c.id > self.last_change).order_by(changes.c.id).limit(limit)
+        )).all()
+        if self.pending:
+            logged += (await connection.execute(statement.where(changes.c.id.in_(list(self.pending))))).all()
+        book_ids = {book_id for _, book_id in logged}
+        if book_ids:
+            rows = (await connection.execute(
+                select(books.c.id, books.c.title, books.c.description, books.c.genre, books.c.author)
+                .where(books.c.id.in_(book_ids))
+            )).all()
+            savers = {book_id: [] for book_id in book_ids}
+            for book_id, user_id in await connection.execute(
+                select(user_books.c.book_id, user_books.c.user_id).where(user_books.c.book_id.in_(book_ids))
+            ):
+                savers[book_id].append(user_id)
+            # Off the event loop, so that requests keep being served between bytecodes
+            await asyncio.to_thread(self._recompute, rows, savers)
+        change_ids = [change_id for change_id, _ in logged]
+        self._track(change_ids, max(change_ids, default=self.last_change))
+        self.synced_at = time.time()
+        self._write_meta(self.generation, self.documents, 0 if self.centroids is None else len(self.centroids))
+        self.open()
+        # Every writer prunes; a row is only removed once no machine still syncing can need it
+        await connection.execute(
+            delete(changes).where(changes.c.created_at < _ago(RECOMMEND_CHANGE_RETENTION_SECONDS))
+        )
+        return len(logged)
+
+    def _recompute(self, rows, savers):
+        """Write the vectors of the books in savers; rows holds the ones that still exist."""
+        book_ids = list(savers)
+        if max(book_ids) >= len(self.content):
+            self._grow(self._capacity(max(book_ids)))
+        # Deleted books keep zero rows and so never match
+        self.content[book_ids] = 0
+        for book_id, title, description, genre, author in rows:
+            self.content[book_id] = content_vector(title, description, genre, author,
+                                                   self.vocabulary, self.documents)
+        for book_id, user_ids in savers.items():
+            self.saves[book_id] = saves_vector(user_ids)
+        if self.centroids is not None:
+            self.clusters[book_ids] = _nearest(self.centroids, self.content[book_ids], self.saves[book_ids])
+            self.clusters.flush()
+        self.content.flush()
+        self.saves.flush()
+
+
+similarity_index = SimilarityIndex()
+
+
+async def books_changed(db: AsyncSession, book_ids):
+    """Log books whose text or savers changed for a vector refresh, inside the caller's transaction."""
+    book_ids = set(book_ids)
+    if book_ids:
+        await db.execute(insert(models.SimilarityChange.__table__), [{"book_id": book_id} for book_id in book_ids])
+
+
+async def maintain(index=similarity_index, interval=RECOMMEND_REFRESH_SECONDS):
+    """Background task of web processes: become the writer when the lock is free, then apply logged changes.
+
+    The index itself comes from an offline build; until one exists, similar() raises IndexNotReady.
+    """
+    from .database import async_engine
+
+    while not await asyncio.to_thread(index.acquire_writer):
+        await asyncio.sleep(interval)
+    if not index.open():
+        logger.warning("No similarity index in %s; build it with `python -m backend.src.recommend`",
+                       index.directory)
+        while not index.open():
+            await asyncio.sleep(interval)
+    if index.stale():
+        logger.warning("The similarity index in %s was built before the oldest logged change still kept; "
+                       "some books may be out of date until the next build", index.directory)
+    while True:
+        applied = 0
+        try:
+            async with async_engine.begin() as connection:
+                applied = await index.refresh(connection)
+        except Exception:
+            logger.exception("Updating the similarity index failed")
+        await asyncio.sleep(CATCH_UP_SECONDS if applied >= REFRESH_BATCH_SIZE else interval)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    if not similarity_index.acquire_writer():
+        raise SystemExit(f"Another process is maintaining the index in {RECOMMEND_DIR}; stop it first")
+    with engine.begin() as connection:
+        print(f"Indexed {similarity_index.build(connection)} books into {RECOMMEND_DIR}")
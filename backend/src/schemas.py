@@ -1,3 +1,4 @@
+from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional
 
@@ -41,13 +42,86 @@ class BookUpdate(BookBase):
 
 class Book(BookBase):
     id: int
+    version: Optional[int] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
 
+class BookSummary(BaseModel):
+    """List view of a book: what a book card shows, without description or version."""
+    id: int
+    title: str
+    author: str
+    genre: str
+    rating: float
+    image_url: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+class SimilarBook(BookSummary):
+    # Weighted cosine similarity to the requested book, between 0 and 1
+    score: float
+
+class BookPage(BaseModel):
+    items: list[Book]
+    next_cursor: Optional[str] = None
+
+class RankedBook(Book):
+    save_count: int = 0
+    # Bayesian score; None while the book is unrated or has no saves
+    score: Optional[float] = None
+    # Share of the genre's books rated lower, ties counting half
+    genre_percentile: Optional[float] = None
+
+class RankedBookPage(BaseModel):
+    items: list[RankedBook]
+    next_cursor: Optional[str] = None
+
+class GenreRatingStats(BaseModel):
+    genre: str
+    book_count: int
+    mean_rating: float
+    percentiles: dict[str, float]
+
+class FacetCount(BaseModel):
+    id: int
+    name: str
+    count: int
+
+class Facets(BaseModel):
+    # Number of matching books; exact is false when a text search matched more
+    # books than are scanned for facets, and counts then cover only those
+    total: int
+    exact: bool = True
+    genres: list[FacetCount]
+    authors: list[FacetCount]
+
 class UserBook(BaseModel):
     user_id: int
     book_id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class UserBookBatch(BaseModel):
+    add: list[int] = []
+    remove: list[int] = []
+
+class UserBookBatchItem(BaseModel):
+    book_id: int
+    action: str
+    # added, already_present, removed, not_present or book_not_found
+    status: str
+
+class UserBookBatchResult(BaseModel):
+    user_id: int
+    results: list[UserBookBatchItem]
+
+# Helpers that work the same with pydantic 1 and 2
+def field_names(model):
+    return list(getattr(model, "model_fields", None) or model.__fields__)
+
+def from_orm(model, obj):
+    return model(**{name: getattr(obj, name) for name in field_names(model)})
@@ -0,0 +1,266 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import func, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Pagination is mandatory for search: callers never get an unbounded result set
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Relative weight of a query term matching the title, author or genre
+FIELD_WEIGHTS = {"title": 3.0, "author": 2.0, "genre": 1.0}
+
+# Same default as pg_trgm's similarity_threshold
+TRIGRAM_THRESHOLD = 0.3
+
+PREFIX_MIN_LENGTH = 2
+PREFIX_MAX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class BookIndex:
+    """In-process inverted index over book title, author and genre.
+
+    Used when the database is not Postgres (e.g. SQLite test setups). Each term
+    maps to the books containing it, and each term's trigrams map back to the
+    term so that misspelled query words can still be matched.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._clear()
+
+    def _clear(self):
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._term_trigrams = defaultdict(set)
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def load(self, db: Session, batch_size: int = 10000):
+        with self._lock:
+            self._clear()
+            rows = db.query(
+                models.Book.id, models.Book.title, models.Book.author, models.Book.genre, models.Book.rating
+            ).yield_per(batch_size)
+            for row in rows:
+                self._add(row.id, row.title, row.author, row.genre, row.rating)
+            self.loaded = True
+
+    def add(self, book):
+        with self._lock:
+            self._remove(book.id)
+            self._add(book.id, book.title, book.author, book.genre, book.rating)
+
+    def remove(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def _add(self, book_id, title, author, genre, rating):
+        fields = {"title": title or "", "author": author or "", "genre": genre or ""}
+        self._docs[book_id] = ({name: value.lower() for name, value in fields.items()}, rating)
+        weights = defaultdict(float)
+        for name, value in fields.items():
+            for token in tokenize(value):
+                weights[token] = max(weights[token], FIELD_WEIGHTS[name])
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._vocabulary_dirty = True
+                for trigram in trigrams(token):
+                    self._term_trigrams[trigram].add(token)
+            self._postings[token][book_id] = weight
+
+    def _remove(self, book_id):
+        doc = self._docs.pop(book_id, None)
+        if doc is None:
+            return
+        fields, _ = doc
+        for token in {token for value in fields.values() for token in tokenize(value)}:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(book_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_dirty = True
+                for trigram in trigrams(token):
+                    self._term_trigrams[trigram].discard(token)
+
+    def _expand(self, token):
+        """Return {term: match quality} for exact, prefix and fuzzy matches of a query token."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        if len(token) >= PREFIX_MIN_LENGTH:
+            if self._vocabulary_dirty:
+                self._vocabulary = sorted(self._postings)
+                self._vocabulary_dirty = False
+            i = bisect_left(self._vocabulary, token)
+            while i < len(self._vocabulary) and len(matches) < PREFIX_MAX_EXPANSIONS:
+                term = self._vocabulary[i]
+                if not term.startswith(token):
+                    break
+                matches.setdefault(term, 0.8)
+                i += 1
+        if not matches:
+            query_trigrams = trigrams(token)
+            shared = defaultdict(int)
+            for trigram in query_trigrams:
+                for term in self._term_trigrams.get(trigram, ()):
+                    shared[term] += 1
+            for term, count in shared.items():
+                similarity = count / (len(query_trigrams) + len(trigrams(term)) - count)
+                if similarity >= TRIGRAM_THRESHOLD:
+                    matches[term] = 0.6 * similarity
+        return matches
+
+    def search(self, q, title=None, author=None, genre=None, rating=None, skip=0, limit=DEFAULT_LIMIT):
+        """Return the ids of the requested page of books matching every query token, best first."""
+        with self._lock:
+            total = len(self._docs) or 1
+            scores = None
+            for token in dict.fromkeys(tokenize(q)):
+                token_scores = defaultdict(float)
+                for term, quality in self._expand(token).items():
+                    postings = self._postings[term]
+                    idf = math.log(1 + total / len(postings))
+                    for book_id, weight in postings.items():
+                        token_scores[book_id] = max(token_scores[book_id], weight * idf * quality)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {book_id: score + token_scores[book_id]
+                              for book_id, score in scores.items() if book_id in token_scores}
+                if not scores:
+                    return []
+            if scores is None:
+                return []
+
+            filters = [(name, value.lower()) for name, value in
+                       (("title", title), ("author", author), ("genre", genre)) if value]
+            ranked = []
+            for book_id, score in scores.items():
+                fields, book_rating = self._docs[book_id]
+                if any(value not in fields[name] for name, value in filters):
+                    continue
+                if rating and (book_rating is None or book_rating < rating):
+                    continue
+                ranked.append((-score, book_id))
+            ranked.sort()
+            return [book_id for _, book_id in ranked[skip:skip + limit]]
+
+
+_fallback_index = BookIndex()
+
+
+def _is_postgres(db: AsyncSession):
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _tsquery(tokens):
+    # Every token is matched as a prefix, so "gats" finds "gatsby"
+    return func.to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{token}:*" for token in tokens))
+
+
+def _filter(statement, tokens, title=None, author=None, genre=None, rating=None):
+    """Apply the search conditions to statement; returns it with a rank expression (None without tokens)."""
+    # On Postgres these filters are served by the trigram GIN indexes
+    if title:
+        statement = statement.where(models.Book.title.ilike(f"%{title}%"))
+    if author:
+        statement = statement.where(models.Book.author.ilike(f"%{author}%"))
+    if genre:
+        statement = statement.where(models.Book.genre.ilike(f"%{genre}%"))
+    if rating:
+        statement = statement.where(models.Book.rating >= rating)
+    if not tokens:
+        return statement, None
+    document = literal_column(models.BOOK_SEARCH_DOCUMENT)
+    tsquery = _tsquery(tokens)
+    text = " ".join(tokens)
+    # Full-text prefix matches, plus trigram matches to tolerate typos
+    statement = statement.where(or_(
+        document.op("@@")(tsquery),
+        models.Book.title.op("%")(text),
+        models.Book.author.op("%")(text),
+    ))
+    return statement, func.ts_rank(document, tsquery) + func.similarity(models.Book.title, text)
+
+
+async def search_books(db: AsyncSession, q: str = None, title: str = None, author: str = None, genre: str = None,
+                       rating: float = None, skip: int = 0, limit: int = DEFAULT_LIMIT, columns=None):
+    """Return the requested page of matching books, best first.
+
+    With columns, rows of just those columns are returned instead of Book objects.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    skip = max(0, skip)
+    tokens = tokenize(q)
+
+    if tokens and not _is_postgres(db):
+        if not _fallback_index.loaded:
+            await db.run_sync(_fallback_index.load)
+        page_ids = _fallback_index.search(q, title=title, author=author, genre=genre, rating=rating,
+                                          skip=skip, limit=limit)
+        if not page_ids:
+            return []
+        result = await _fetch(db, select(*(columns or [models.Book])).where(models.Book.id.in_(page_ids)), columns)
+        books = {book.id: book for book in result}
+        return [books[book_id] for book_id in page_ids if book_id in books]
+
+    statement, rank = _filter(select(*(columns or [models.Book])), tokens, title, author, genre, rating)
+    if rank is not None:
+        statement = statement.order_by(rank.desc(), models.Book.id)
+    else:
+        statement = statement.order_by(models.Book.id)
+
+    return await _fetch(db, statement.offset(skip).limit(limit), columns)
+
+
+async def _fetch(db: AsyncSession, statement, columns):
+    if columns:
+        return (await db.execute(statement)).all()
+    return (await db.scalars(statement)).all()
+
+
+async def matching_statement(db: AsyncSession, columns, q: str = None, title: str = None, author: str = None,
+                             genre: str = None, rating: float = None, limit: int = None):
+    """A select of columns over (up to limit of) the books matching a search, in no particular order."""
+    tokens = tokenize(q)
+    if tokens and not _is_postgres(db):
+        if not _fallback_index.loaded:
+            await db.run_sync(_fallback_index.load)
+        ids = _fallback_index.search(q, title=title, author=author, genre=genre, rating=rating,
+                                     limit=limit or len(_fallback_index._docs))
+        return select(*columns).where(models.Book.id.in_(ids))
+    statement, _ = _filter(select(*columns), tokens, title, author, genre, rating)
+    return statement.limit(limit) if limit else statement
+
+
+# Keep the in-process index in sync with writes made through crud
+def index_book(db: AsyncSession, book):
+    if _fallback_index.loaded and not _is_postgres(db):
+        _fallback_index.add(book)
+
+
+def unindex_book(db: AsyncSession, book_id: int):
+    if _fallback_index.loaded and not _is_postgres(db):
+        _fallback_index.remove(book_id)
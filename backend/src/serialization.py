@@ -0,0 +1,32 @@
+"""JSON encoding for hot read paths.
+
+List responses are built as plain dicts straight from ORM objects or column
+rows and encoded in one call, skipping per-item model validation and
+jsonable_encoder. The output matches what the pydantic schemas produce.
+"""
+import json
+from datetime import date
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library produces the same output, only slower
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, date):
+        # Same as orjson and pydantic: isoformat, naive datetimes without an offset
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Compact JSON for plain data (dicts, lists, numbers, strings, datetimes)."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), default=_default).encode()
+
+
+def book_dicts(books, fields):
+    """Plain mappings of fields for ORM books or column rows, without model validation."""
+    return [{name: getattr(book, name) for name in fields} for book in books]
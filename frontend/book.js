@@ -120,6 +120,49 @@ document.addEventListener("DOMContentLoaded", async () => {
     bookDetails.innerHTML = "<p>Error fetching book details. Please try again.</p>";
   }
 
+  // Similar books come from the recommendation index; the section stays hidden when there are none
+  async function loadSimilarBooks() {
+    const similarSection = document.getElementById("similar-section");
+    const similarGrid = document.getElementById("similar-books");
+    try {
+      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/books/${bookId}/similar?k=8`);
+      if (!response.ok) {
+        // 503 while the index is still being built
+        return;
+      }
+      const books = await response.json();
+      books.forEach((book) => {
+        const bookCard = document.createElement("div");
+        bookCard.className = "book-card";
+        bookCard.innerHTML = `
+          <img src="${book.image_url}" alt="${book.title}">
+          <div class="book-info">
+              <h3 class="book-title" data-book-id="${book.id}">${book.title}</h3>
+              <p class="author">${book.author}</p>
+              <button class="genre" data-genre="${book.genre}">${book.genre}</button>
+              <div class="rating">
+                  ${"★".repeat(Math.floor(book.rating))}${"☆".repeat(5 - Math.floor(book.rating))}
+              </div>
+          </div>
+        `;
+        bookCard.querySelector(".genre").addEventListener("click", () => {
+          window.location.href = `search.html?genre=${encodeURIComponent(book.genre)}`;
+        });
+        bookCard.querySelector(".book-title").addEventListener("click", () => {
+          window.location.href = `/static/book.html?id=${book.id}`;
+        });
+        similarGrid.appendChild(bookCard);
+      });
+      if (books.length) {
+        similarSection.style.display = "block";
+      }
+    } catch (error) {
+      console.error("Error fetching similar books:", error);
+    }
+  }
+
+  loadSimilarBooks();
+
   // Function to fetch current user
   async function fetchCurrentUser() {
     const token = getToken();
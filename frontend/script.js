@@ -66,8 +66,7 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
   }
 
-  function displayBooks(books) {
-    bookGrid.innerHTML = "";
+  function renderBookCards(books) {
     books.forEach((book) => {
       const bookCard = document.createElement("div");
       bookCard.className = "book-card";
@@ -88,6 +87,9 @@ document.addEventListener("DOMContentLoaded", async () => {
           </div>
       `;
   
+      if (savedBookIds.has(book.id)) {
+        markBookSaved(bookCard);
+      }
       bookGrid.appendChild(bookCard);
 
       // Add event listener for genre button
@@ -95,46 +97,121 @@ document.addEventListener("DOMContentLoaded", async () => {
       genreButton.addEventListener("click", () => {
         window.location.href = `search.html?genre=${encodeURIComponent(book.genre)}`;
       });
-    });
-  
-    // Add event listeners to book titles
-    document.querySelectorAll(".book-title").forEach(title => {
-      title.addEventListener("click", (event) => {
-        const bookId = event.target.dataset.bookId;
-        window.location.href = `/static/book.html?id=${bookId}`;
+
+      // Add event listener to book title
+      bookCard.querySelector(".book-title").addEventListener("click", () => {
+        window.location.href = `/static/book.html?id=${book.id}`;
       });
-    });
-  
-    // Add event listeners to "Will Read" and "Read" buttons
-    document.querySelectorAll(".will-read").forEach(button => {
-      button.addEventListener("click", async (event) => {
-          const bookId = event.target.dataset.bookId;
-          await addBookToUserList(bookId, "will-read");
+
+      // Add event listeners to "Will Read" and "Read" buttons
+      bookCard.querySelector(".will-read").addEventListener("click", async () => {
+        await addBookToUserList(book.id, "will-read");
+      });
+
+      bookCard.querySelector(".already-read").addEventListener("click", async () => {
+        await addBookToUserList(book.id, "already-read");
       });
     });
-  
-    document.querySelectorAll(".already-read").forEach(button => {
-        button.addEventListener("click", async (event) => {
-            const bookId = event.target.dataset.bookId;
-            await addBookToUserList(bookId, "already-read");
-        });
+  }
+
+  // Ids of books already on the logged-in user's list
+  const savedBookIds = new Set();
+
+  function markBookSaved(bookCard) {
+    bookCard.querySelectorAll(".will-read, .already-read").forEach((button) => {
+      button.classList.add("in-list");
     });
   }
 
+  // One request per page of cards instead of one membership check per card
+  async function loadSavedBookIds(pageBooks) {
+    if (!user || pageBooks.length === 0) return;
+    const params = new URLSearchParams();
+    pageBooks.forEach((book) => params.append("book_ids", book.id));
+    try {
+      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/users/${user.id}/books/?${params.toString()}`);
+      if (!response.ok) return;
+      const ids = await response.json();
+      ids.forEach((id) => savedBookIds.add(id));
+      bookGrid.querySelectorAll(".book-card").forEach((bookCard) => {
+        const bookId = Number(bookCard.querySelector(".book-title").dataset.bookId);
+        if (savedBookIds.has(bookId)) {
+          markBookSaved(bookCard);
+        }
+      });
+    } catch (error) {
+      console.error("Error fetching saved books:", error);
+    }
+  }
+
+  function displayBooks(books) {
+    bookGrid.innerHTML = "";
+    renderBookCards(books);
+  }
+
+  // Books are loaded page by page with an opaque cursor from the API
+  const PAGE_SIZE = 24;
+  let nextCursor = null;
+  let hasMoreBooks = true;
+  let loadingBooks = false;
+  let searchQuery = "";
+
+  async function loadNextPage() {
+    if (!bookGrid || loadingBooks || !hasMoreBooks) return;
+    loadingBooks = true;
+    try {
+      const params = new URLSearchParams({ limit: PAGE_SIZE, fields: "summary" });
+      if (nextCursor) {
+        params.append("cursor", nextCursor);
+      }
+      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/books/page/?${params.toString()}`);
+      if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const page = await response.json();
+      books = books.concat(page.items);
+      nextCursor = page.next_cursor;
+      hasMoreBooks = nextCursor !== null;
+      if (searchQuery) {
+        filterBooks(searchQuery);
+      } else {
+        renderBookCards(page.items);
+      }
+      await loadSavedBookIds(page.items);
+    } catch (error) {
+      console.error("Error fetching books:", error);
+      // alert(`Failed to load books. Please try again later. ${error}`);
+    } finally {
+      loadingBooks = false;
+    }
+  }
+
+  async function reloadBooks() {
+    books = [];
+    nextCursor = null;
+    hasMoreBooks = true;
+    if (bookGrid) {
+      bookGrid.innerHTML = "";
+    }
+    await loadNextPage();
+  }
+
+  // Fetch the next page whenever the end of the grid scrolls into view
+  const loadMoreSentinel = document.createElement("div");
+  const loadMoreObserver = new IntersectionObserver((entries) => {
+    if (entries.some((entry) => entry.isIntersecting)) {
+      loadNextPage();
+    }
+  }, { rootMargin: "400px" });
+
   // Check if user is already logged in
   user = await fetchCurrentUser();
   displayUserNickname();
 
-  try {
-    const response = await fetch("https://litrank-webtech-3926216d016d.herokuapp.com/books/");
-    if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-    }
-    books = await response.json();
-    displayBooks(books);
-  } catch (error) {
-    console.error("Error fetching books:", error);
-    // alert(`Failed to load books. Please try again later. ${error}`);
+  if (bookGrid) {
+    bookGrid.after(loadMoreSentinel);
+    await loadNextPage();
+    loadMoreObserver.observe(loadMoreSentinel);
   }
 
   async function addBookToUserList(bookId, listType) {
@@ -153,6 +230,11 @@ document.addEventListener("DOMContentLoaded", async () => {
       });
 
       if (response.ok) {
+          savedBookIds.add(bookId);
+          const bookTitle = bookGrid.querySelector(`.book-title[data-book-id="${bookId}"]`);
+          if (bookTitle) {
+            markBookSaved(bookTitle.closest(".book-card"));
+          }
           alert(`Book added to ${listType.replace("-", " ")} list!`);
       } else {
           const errorData = await response.json();
@@ -166,6 +248,7 @@ document.addEventListener("DOMContentLoaded", async () => {
 
 
   function filterBooks(query) {
+    searchQuery = query;
     const filteredBooks = books.filter((book) =>
       book.title.toLowerCase().includes(query.toLowerCase())
     );
@@ -340,13 +423,8 @@ document.addEventListener("DOMContentLoaded", async () => {
         alert("Book added successfully!");
         addBookModal.style.display = "none";
         addBookForm.reset();
-        // Optionally, refresh the book list here
-        const response = await fetch("https://litrank-webtech-3926216d016d.herokuapp.com/books/");
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        books = await response.json();
-        displayBooks(books);
+        // Refresh the book list from the first page
+        await reloadBooks();
       } else {
         const errorData = await response.json();
         alert("Error: " + (errorData.detail || "Failed to add book."));
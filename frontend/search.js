@@ -65,9 +65,8 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
   }
 
-  // Function to display books
+  // Function to append books to the results grid
   function displayBooks(books) {
-    advancedSearchGridBooks.innerHTML = '';
     books.forEach((book) => {
       const bookCard = document.createElement("div");
       bookCard.className = "book-card";
@@ -162,11 +161,13 @@ document.addEventListener("DOMContentLoaded", async () => {
       if (response.ok) {
         addBookModal.style.display = "none";
         addBookForm.reset();
-        const response = await fetch("https://litrank-webtech-3926216d016d.herokuapp.com/books/");
+        const response = await fetch("https://litrank-webtech-3926216d016d.herokuapp.com/books/?fields=summary");
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const books = await response.json();
+        hasMoreResults = false;
+        advancedSearchGridBooks.innerHTML = '';
         displayBooks(books);
       } else {
         const errorData = await response.json();
@@ -177,60 +178,82 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
   });
 
-  searchForm.addEventListener('submit', async (event) => {
-    event.preventDefault();
-  
-    const formData = new FormData(searchForm);
-    const queryParams = new URLSearchParams();
-  
-    for (const [key, value] of formData.entries()) {
-      if (value) {
-        queryParams.append(key, value);
-      }
-    }
-  
+  // Search results are paginated (the API returns at most 100 per request); pages are fetched with skip/limit
+  const PAGE_SIZE = 50;
+  let searchParams = null;
+  let skip = 0;
+  let hasMoreResults = false;
+  let loadingResults = false;
+
+  async function loadNextResults() {
+    if (!searchParams || loadingResults || !hasMoreResults) return;
+    loadingResults = true;
     try {
-      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/books/search/?${queryParams.toString()}`);
+      const params = new URLSearchParams(searchParams);
+      params.set("skip", skip);
+      params.set("limit", PAGE_SIZE);
+      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/books/search/?${params.toString()}`);
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const books = await response.json();
-  
-      advancedSearchGridBooks.innerHTML = '';
 
-      if (books && books.length > 0) {
-        displayBooks(books);
-      } else {
+      if (skip === 0 && books.length === 0) {
         advancedSearchGridBooks.innerHTML = '<p>No books found matching your criteria.</p>';
       }
+      displayBooks(books);
+      skip += books.length;
+      hasMoreResults = books.length === PAGE_SIZE;
     } catch (error) {
       console.error("Error fetching search results:", error);
-      advancedSearchGridBooks.innerHTML = '<p>Error fetching search results. Please try again.</p>';
+      hasMoreResults = false;
+      if (skip === 0) {
+        advancedSearchGridBooks.innerHTML = '<p>Error fetching search results. Please try again.</p>';
+      }
+    } finally {
+      loadingResults = false;
     }
-  });
+  }
 
-  // Function to fetch and display books based on genre
-  async function fetchAndDisplayBooksByGenre(genre) {
-    try {
-      const response = await fetch(`https://litrank-webtech-3926216d016d.herokuapp.com/books/search/?genre=${encodeURIComponent(genre)}`);
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
+  async function startSearch(params) {
+    searchParams = params;
+    skip = 0;
+    hasMoreResults = true;
+    advancedSearchGridBooks.innerHTML = '';
+    await loadNextResults();
+  }
+
+  // Fetch the next page of results whenever the end of the grid scrolls into view
+  const loadMoreSentinel = document.createElement("div");
+  advancedSearchGridBooks.after(loadMoreSentinel);
+  const loadMoreObserver = new IntersectionObserver((entries) => {
+    if (entries.some((entry) => entry.isIntersecting)) {
+      loadNextResults();
+    }
+  }, { rootMargin: "400px" });
+  loadMoreObserver.observe(loadMoreSentinel);
+
+  searchForm.addEventListener('submit', async (event) => {
+    event.preventDefault();
+  
+    const formData = new FormData(searchForm);
+    const queryParams = new URLSearchParams({ fields: "summary" });
+  
+    for (const [key, value] of formData.entries()) {
+      if (value) {
+        queryParams.append(key, value);
       }
-      const books = await response.json();
-      
-      displayBooks(books);
-    } catch (error) {
-      console.error("Error fetching books by genre:", error);
-      advancedSearchGridBooks.innerHTML = '<p>Error fetching books. Please try again.</p>';
     }
-  }
+
+    await startSearch(queryParams);
+  });
 
   // Check if there is a genre query parameter in the URL
   const urlParams = new URLSearchParams(window.location.search);
   const genre = urlParams.get('genre');
   if (genre) {
     document.getElementById('search-genre').value = genre;
-    await fetchAndDisplayBooksByGenre(genre);
+    await startSearch(new URLSearchParams({ genre, fields: "summary" }));
   }
 
 });